@@ -1,28 +1,30 @@
 from django import forms
 from django.contrib import admin, messages
 from django.contrib.admin.views.main import ChangeList
-from django.contrib.contenttypes.models import ContentType
-from django.db.models import F, Q, Count, Exists, Subquery, OuterRef
+from django.core.cache import cache
+from django.db.models import F, Q, Count, Exists, Subquery, OuterRef, \
+    prefetch_related_objects
 from django.db.models.functions import Coalesce
 from django.http import HttpResponseRedirect
 from django.template.response import TemplateResponse
 from django.shortcuts import get_object_or_404
 from django.urls import path, reverse
+from django.utils.dateparse import parse_datetime
 from django.utils.safestring import mark_safe
-from django_admin_inline_paginator.admin import TabularInlinePaginated
 from functools import partial
 import types
+import uuid
 
 from formative.admin import site
 from formative.models import Form, SubmissionRecord
 from formative.utils import get_current_site, user_programs
 from .forms import ReferencesFormSet, ReferenceForm, MetricForm, CohortForm, \
     CohortStatusForm, PresentationForm, MetricsExportForm, CombinedExportForm, \
-    PresentationExportForm
+    PresentationExportForm, CohortRuleForm, PartitionForm, ScoreImportForm
 from .models import Template, TemplateSection, Reference, Presentation, Input, \
-    Panel, Cohort, CohortMember, Score, Metric
+    Panel, Cohort, CohortRule, CohortMember, Score, Metric, PanelistProgress
 from .utils import MetricsTabularExport, CombinedTabularExport, \
-     PresentationPrintExport
+     PresentationPrintExport, ScoreImport
 
 
 class TemplateSectionInline(admin.StackedInline):
@@ -281,10 +283,57 @@ class PanelAdmin(admin.ModelAdmin):
         return super().response_change(request, obj)
 
 
-class CohortMemberInline(TabularInlinePaginated):
+def member_cursor(value):
+    # "<submitted>_<id>" of the last member on the previous page
+    if not value: return None
+    submitted, _, object_id = value.rpartition('_')
+    try: object_id = uuid.UUID(object_id)
+    except ValueError: return None
+    if not submitted: return None, object_id
+    
+    submitted = parse_datetime(submitted)
+    if not submitted: return None
+    return submitted, object_id
+
+
+class CohortMemberFormSet(forms.BaseInlineFormSet):
+    per_page, params, cursor = 100, None, None
+    
+    def get_queryset(self):
+        # one page past the cursor, fetching a row extra rather than a COUNT
+        if not hasattr(self, 'has_next'):
+            members = []
+            if self.instance.form.model:
+                members = CohortMember.objects.members_page(
+                    self.instance, self.cursor, size=self.per_page + 1
+                )
+            self.has_next = len(members) > self.per_page
+            self._queryset = members[:self.per_page]
+        return self._queryset
+    
+    def next_query(self):
+        if not self.get_queryset() or not self.has_next: return None
+        
+        last = self.get_queryset()[-1]
+        submitted = last.submitted.isoformat() if last.submitted else ''
+        params = self.params.copy()
+        params[CohortMemberInline.cursor_key] = f'{submitted}_{last.object_id}'
+        return params.urlencode()
+    
+    def first_query(self):
+        if CohortMemberInline.cursor_key not in self.params: return None
+        
+        params = self.params.copy()
+        del params[CohortMemberInline.cursor_key]
+        return params.urlencode()
+
+
+class CohortMemberInline(admin.TabularInline):
     model = CohortMember
+    formset = CohortMemberFormSet
+    template = 'admin/reviewpanel/cohort/members_inline.html'
     extra = 0
-    per_page = 100
+    per_page, cursor_key = 100, 'members_before'
     can_delete = True
     exclude = ('content_type', 'object_id')
     readonly_fields = ('email', 'submitted')
@@ -292,33 +341,35 @@ class CohortMemberInline(TabularInlinePaginated):
     def has_add_permission(self, request, obj=None):
         return False
     
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        match = request.resolver_match
-        cohort = Cohort.objects.get(pk=match.kwargs['object_id'])
-        model = cohort.form.model
-        if not model: return queryset
-        
-        obj = model.objects.values('pk').filter(pk=OuterRef('object_id'))
-        qs = queryset.annotate(email=Subquery(obj.values('_email')),
-                               submitted=Subquery(obj.values('_submitted')))
-        return qs.order_by('-submitted')
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.per_page, formset.params = self.per_page, request.GET
+        formset.cursor = member_cursor(request.GET.get(self.cursor_key))
+        return formset
     
     def email(self, object):
-        return object.email # TODO: link to the submission change view
+        # TODO: link to the submission change view
+        return getattr(object, 'email', None)
     
     def submitted(self, object):
         return object.submitted
 
 
+class CohortRuleInline(admin.StackedInline):
+    model = CohortRule
+    form = CohortRuleForm
+    extra = 0
+
+
 @admin.register(Cohort, site=site)
 class CohortAdmin(FormAttached, admin.ModelAdmin):
     form = CohortForm
     list_display = ('name', 'panel', 'status', 'form')
     list_filter = ('panel', 'status', 'form')
-    inlines = [CohortMemberInline]
+    inlines = [CohortRuleInline, CohortMemberInline]
     readonly_fields = ('primary_input', 'size')
-    actions = ['change_status']
+    actions = ['change_status', 'preview_rules', 'apply_rules',
+               'refresh_from_rules']
     
     def get_fields(self, request, obj=None):
         fields = super().get_fields(request, obj)
@@ -327,7 +378,8 @@ class CohortAdmin(FormAttached, admin.ModelAdmin):
         
     def get_formsets_with_inlines(self, request, obj=None):
         for inline in self.get_inline_instances(request, obj):
-            if not isinstance(inline, CohortMemberInline) or obj is not None:
+            if obj is not None or not isinstance(inline, (CohortMemberInline,
+                                                          CohortRuleInline)):
                 yield inline.get_formset(request, obj), inline
     
     def get_form(self, request, obj=None, **kwargs):
@@ -347,12 +399,36 @@ class CohortAdmin(FormAttached, admin.ModelAdmin):
         form.base_fields['presentation'].queryset = qs
         return form
     
+    def save_model(self, request, obj, form, change):
+        if not change: return super().save_model(request, obj, form, change)
+        
+        # size is kept with F() updates as members come and go, so leave it be
+        fields = [ f.name for f in obj._meta.concrete_fields
+                   if not f.primary_key and f.name != 'size' ]
+        obj.save(update_fields=fields)
+    
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
-        if change: # save the cohort again with an updated size count
-            obj = form.instance
-            obj.size = obj.cohortmember_set.count()
-            self.save_model(request, obj, form, change)
+        
+        removed = sum(len(formset.deleted_objects) for formset in formsets
+                      if formset.model is CohortMember)
+        if removed: # members can only be deleted here, not added
+            cohorts = Cohort.objects.filter(pk=form.instance.pk)
+            cohorts.update(size=F('size') - removed)
+        PanelistProgress.objects.refresh(form.instance.form)
+    
+    def delete_model(self, request, obj):
+        cohorts = Cohort.objects.filter(pk=obj.pk)
+        panelists = PanelistProgress.objects.panelists(cohorts)
+        super().delete_model(request, obj)
+        PanelistProgress.objects.refresh(obj.form, panelists=panelists)
+    
+    def delete_queryset(self, request, queryset):
+        forms = list(Form.objects.filter(cohort__in=queryset).distinct())
+        panelists = PanelistProgress.objects.panelists(queryset)
+        super().delete_queryset(request, queryset)
+        for program_form in forms:
+            PanelistProgress.objects.refresh(program_form, panelists=panelists)
     
     def primary_input(self, obj):
         input = obj.inputs.order_by('_rank')[:1]
@@ -362,8 +438,11 @@ class CohortAdmin(FormAttached, admin.ModelAdmin):
     def change_status(self, request, queryset):
         if '_submit' in request.POST:
             status, message = request.POST['status'], request.POST['message']
+            forms = list(Form.objects.filter(cohort__in=queryset).distinct())
             if message: n = queryset.update(status=status, message=message)
             else: n = queryset.update(status=status)
+            for program_form in forms:
+                PanelistProgress.objects.refresh(program_form)
             
             msg = f'Status changed for {n} cohorts.'
             self.message_user(request, msg, messages.SUCCESS)
@@ -377,6 +456,41 @@ class CohortAdmin(FormAttached, admin.ModelAdmin):
             'form': CohortStatusForm()
         }
         return TemplateResponse(request, template_name, context)
+    
+    @admin.action(description='Preview rule matches for selected cohorts')
+    def preview_rules(self, request, queryset):
+        for cohort in queryset.select_related('form'):
+            matches = cohort.rule_matches()
+            if matches is None:
+                msg = f'Cohort "{cohort.name}" has no rules.'
+                self.message_user(request, msg, messages.WARNING)
+                continue
+            
+            members = cohort.cohortmember_set.values('object_id')
+            count = matches.count()
+            new = matches.exclude(pk__in=members).count()
+            msg = f'Cohort "{cohort.name}": {count} submissions match, ' \
+                  f'{new} not yet members.'
+            self.message_user(request, msg, messages.INFO)
+    
+    def run_rules(self, request, queryset, remove=False):
+        for cohort in queryset.select_related('form', 'panel'):
+            added, removed = cohort.apply_rules(remove=remove)
+            if cohort.panel and (added or removed):
+                PanelistProgress.objects.refresh(cohort.form,
+                                                 panel=cohort.panel)
+            
+            msg = f'Cohort "{cohort.name}": {added} members added'
+            if remove: msg += f', {removed} removed'
+            self.message_user(request, msg + '.', messages.SUCCESS)
+    
+    @admin.action(description='Add submissions matching rules')
+    def apply_rules(self, request, queryset):
+        self.run_rules(request, queryset)
+    
+    @admin.action(description='Refresh membership from rules')
+    def refresh_from_rules(self, request, queryset):
+        self.run_rules(request, queryset, remove=True)
 
 
 class ScoreTypeFilter(admin.SimpleListFilter):
@@ -396,13 +510,24 @@ class ScoreTypeFilter(admin.SimpleListFilter):
         elif self.value() == 'no': return queryset.filter(value__isnull=True)
 
 
+class ScoreChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # one query per content type for the page, rather than one per row
+        prefetch_related_objects(self.result_list, 'submission')
+
+
 @admin.register(Score, site=site)
 class ScoreAdmin(admin.ModelAdmin):
     list_display = ('submission', 'panelist', 'input', 'cohort', 'display_val',
                     'created')
+    list_select_related = ('panelist', 'input', 'cohort')
     list_filter = ('panelist', 'input', 'cohort', 'form', ScoreTypeFilter)
     readonly_fields = ('submission_link',)
     
+    def get_changelist(self, request, **kwargs):
+        return ScoreChangeList
+    
     def get_fields(self, request, obj=None):
         fields = super().get_fields(request, obj)
         if obj: return tuple(f for f in fields
@@ -431,6 +556,22 @@ class ScoreAdmin(admin.ModelAdmin):
         return user_programs(queryset.filter(form__program__sites=site),
                              'form__program__', request)
     
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if obj.panelist:
+            PanelistProgress.objects.refresh(obj.form, panelist=obj.panelist)
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        if obj.panelist:
+            PanelistProgress.objects.refresh(obj.form, panelist=obj.panelist)
+    
+    def delete_queryset(self, request, queryset):
+        forms = list(Form.objects.filter(score__in=queryset).distinct())
+        super().delete_queryset(request, queryset)
+        for program_form in forms:
+            PanelistProgress.objects.refresh(program_form)
+    
     @admin.display(ordering='value', description='value')
     def display_val(self, obj):
         if obj.input.type == Input.InputType.TEXT: return obj.text
@@ -448,6 +589,19 @@ class ScoreAdmin(admin.ModelAdmin):
         return mark_safe(f'<a href="{url}">{obj.submission}</a>')
 
 
+def permitted_program_slugs(request):
+    # None if unrestricted; computed once per request, as the admin checks
+    # permissions many times over for each of the registered proxy models
+    if not hasattr(request, '_reviewpanel_program_slugs'):
+        user, slugs = request.user, None
+        if not user.is_superuser or user.site:
+            programs = user.site.programs if user.is_superuser \
+                       else user.programs
+            slugs = frozenset(programs.values_list('slug', flat=True))
+        request._reviewpanel_program_slugs = slugs
+    return request._reviewpanel_program_slugs
+
+
 class FormChangeList(ChangeList):
     def url_for_result(self, result):
         name = result.program.db_slug + '_' + result.db_slug
@@ -457,15 +611,11 @@ class FormChangeList(ChangeList):
 class ProgramFormsAdmin(admin.ModelAdmin):
     list_display = ('name', 'submitted', 'created', 'modified')
     list_select_related = ('program',)
-    actions = ['export_ods']
+    actions = ['export_ods', 'import_scores']
     
     def has_view_permission(self, request, obj=None):
-        site, programs = get_current_site(request), request.user.programs
-        if request.user.is_superuser:
-            if not request.user.site: return True
-            programs = request.user.site.programs
-        slug = self.model._meta.program_slug
-        return slug in programs.values_list('slug', flat=True)
+        slugs = permitted_program_slugs(request)
+        return slugs is None or self.model._meta.program_slug in slugs
     
     def has_add_permission(self, request): return False
     def has_change_permission(self, request, obj=None): return False
@@ -508,6 +658,44 @@ class ProgramFormsAdmin(admin.ModelAdmin):
             'form': CombinedExportForm()
         }
         return TemplateResponse(request, template_name, context)
+    
+    @admin.action(description='Import scores from a spreadsheet')
+    def import_scores(self, request, queryset):
+        if queryset.count() != 1:
+            msg = 'Select one form to import scores for.'
+            self.message_user(request, msg, messages.WARNING)
+            return None
+        program_form = queryset.get()
+        
+        errors, form = None, ScoreImportForm()
+        if '_import' in request.POST:
+            form = ScoreImportForm(request.POST, request.FILES)
+        if form.is_bound and form.is_valid():
+            upload = form.cleaned_data['file']
+            file_type = upload.name.rpartition('.')[2].lower()
+            score_import = ScoreImport(program_form, get_current_site(request),
+                                       dry_run=form.cleaned_data['dry_run'])
+            try: imported = score_import.import_file(file_type, upload)
+            except ScoreImport.read_errors as e:
+                form.add_error('file', f'Could not read the file, so no '
+                                       f'scores were imported: {e}')
+            else:
+                errors = score_import.errors
+                verb = 'validated' if score_import.dry_run else 'imported'
+                msg = f'{imported} scores {verb}, {len(errors)} rows in error.'
+                level = messages.WARNING if errors else messages.SUCCESS
+                self.message_user(request, msg, level)
+                if not errors:
+                    return HttpResponseRedirect(request.get_full_path())
+        
+        template_name = 'admin/reviewpanel/import_scores.html'
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta, 'media': self.media,
+            'program_form': program_form, 'title': 'Import Scores',
+            'form': form, 'errors': errors
+        }
+        return TemplateResponse(request, template_name, context)
 
 
 class BaseScoreFormSet(forms.BaseModelFormSet):
@@ -515,6 +703,7 @@ class BaseScoreFormSet(forms.BaseModelFormSet):
         self.instance = instance
         super().__init__(*args, **kwargs)
         scores = Score.objects.filter(object_id=instance.pk)
+        scores = scores.select_related('panelist', 'input', 'cohort')
         self.queryset = scores.order_by('created')
     
     @classmethod
@@ -526,15 +715,15 @@ class BaseScoreFormSet(forms.BaseModelFormSet):
 class SubmissionScoresInline(admin.TabularInline):
     model = Score
     formset = BaseScoreFormSet
-    readonly_fields = ('display_val', 'created',)
+    # rendered as text, rather than a select with every choice for each row
+    readonly_fields = ('panelist', 'input', 'cohort', 'display_val', 'created')
     
     def has_add_permission(self, request, obj=None): return False
+    def has_change_permission(self, request, obj=None): return False
     
     def get_formset(self, request, obj=None, **kwargs):
-        fields = ('panelist', 'input', 'cohort',)
-        
         defaults = {
-            'form': self.form, 'formset': self.formset, 'fields': fields,
+            'form': self.form, 'formset': self.formset, 'fields': (),
             'formfield_callback': partial(self.formfield_for_dbfield,
                                           request=request),
             'extra': 0, 'can_delete': False, 'can_order': False
@@ -572,33 +761,54 @@ class FormSubmissionsAdmin(admin.ModelAdmin):
     list_filter = (CohortListFilter,)
     list_per_page = 400
     inlines = [SubmissionScoresInline]
-    actions = ['add_to_cohort', 'export_csv', 'export_pdf']
+    actions = ['add_to_cohort', 'partition_cohorts', 'export_csv',
+               'export_pdf']
     
     def has_module_permission(self, request):
         return False # it's linked to by ProgramFormsAdmin, don't show in index
     
     def has_view_permission(self, request, obj=None):
-        site, programs = get_current_site(request), request.user.programs
-        if request.user.is_superuser:
-            if not request.user.site: return True
-            programs = request.user.site.programs
-        slug = self.model._meta.program_slug
-        return slug in programs.values_list('slug', flat=True)
+        slugs = permitted_program_slugs(request)
+        return slugs is None or self.model._meta.program_slug in slugs
     
     def has_add_permission(self, request): return False
     def has_change_permission(self, request, obj=None): return False
     def has_delete_permission(self, request, obj=None): return False
     
+    def cohort_filter(self, request):
+        cohort_id = request.GET.get('cohort')
+        if cohort_id and cohort_id.isdigit(): return int(cohort_id)
+        return None
+    
+    def metrics_cache(self, request):
+        # kept on the request; the admin instance is shared by concurrent ones
+        if not hasattr(request, 'reviewpanel_metrics'):
+            request.reviewpanel_metrics = {}
+        return request.reviewpanel_metrics
+    
     def get_metrics(self, request, **kwargs):
+        cohort_id = self.cohort_filter(request)
+        metrics_cache = self.metrics_cache(request)
+        key = (cohort_id, tuple(sorted(kwargs.items())))
+        if key in metrics_cache: return metrics_cache[key]
+        
+        # reused across requests, until a metric, input or cohort input changes
+        filters = ','.join(f'{k}={v}' for k, v in key[1])
+        cache_key = f'reviewpanel_admin_metrics_{Metric.metrics_version()}_' \
+                    f'{self.model._meta.db_table}_{cohort_id}_{filters}'
+        metrics_cache[key] = cache.get(cache_key)
+        if metrics_cache[key]: return metrics_cache[key]
+        
         fs, ps = self.model._meta.form_slug, self.model._meta.program_slug
         form = Form.objects.get(slug=fs, program__slug=ps)
-        cohort_id = request.GET.get('cohort')
         
         metrics = Metric.objects.filter(admin_enabled=True,
                                         input__cohort__form=form, **kwargs)
-        if cohort_id and cohort_id.isdigit():
-            metrics = metrics.filter(input__cohort=int(cohort_id))
-        return metrics.distinct(), form
+        if cohort_id: metrics = metrics.filter(input__cohort=cohort_id)
+        metrics = list(metrics.distinct().select_related('input'))
+        metrics_cache[key] = metrics, form
+        cache.set(cache_key, (metrics, form))
+        return metrics, form
     
     def get_queryset(self, request):
         queryset = self.model.objects.exclude(_submitted__isnull=True)
@@ -612,12 +822,18 @@ class FormSubmissionsAdmin(admin.ModelAdmin):
         
         return queryset
     
-    def get_list_display(self, request):
-        fields = list(super().get_list_display(request))
-        
+    def metric_fields(self, request):
         metrics, _ = self.get_metrics(request)
+        key = ('fields', self.cohort_filter(request))
+        metrics_cache = self.metrics_cache(request)
+        if key in metrics_cache: return metrics_cache[key]
+        
+        def order(metric): # by input, with the divisor first
+            return metric.input.form_id, metric.input._rank, \
+                not metric.count_is_divisor
+        
         divisors, metric_fields = {}, []
-        for metric in metrics.order_by('input', '-count_is_divisor'):
+        for metric in sorted(metrics, key=order):
             def field_callable(desc, field, divisor_field=None):
                 @admin.display(description=desc, ordering=field)
                 def callable(self, obj):
@@ -637,12 +853,9 @@ class FormSubmissionsAdmin(admin.ModelAdmin):
             if metric.type == Metric.MetricType.COUNT and input_id in divisors:
                 divisor_name = divisors[metric.input_id]
             if metric.count_is_divisor: divisors[input_id] = field_name
-
-            c = field_callable(metric.name, field_name, divisor_name)
-            # Django will reject the ordering if value isn't a field or method:
-            setattr(self, field_name, types.MethodType(c, self))
             
-            rec = (field_name, metric.position)
+            c = field_callable(metric.name, field_name, divisor_name)
+            rec = (field_name, metric.position, types.MethodType(c, self))
             for i, v in enumerate(metric_fields):
                 if v[1] > metric.position:
                     metric_fields.insert(i, rec)
@@ -650,6 +863,17 @@ class FormSubmissionsAdmin(admin.ModelAdmin):
                     break
             if rec: metric_fields.append(rec)
         
+        metrics_cache[key] = metric_fields
+        return metric_fields
+    
+    def get_list_display(self, request):
+        fields = list(super().get_list_display(request))
+        
+        metric_fields = self.metric_fields(request)
+        for field_name, position, method in metric_fields:
+            # Django will reject the ordering if value isn't a field or method:
+            setattr(self, field_name, method)
+        
         cohort_id, end_fields = request.GET.get('cohort'), []
         if cohort_id and cohort_id.isdigit():
             pres = None
@@ -678,16 +902,10 @@ class FormSubmissionsAdmin(admin.ModelAdmin):
     def add_to_cohort(self, request, queryset):
         if 'cohort' in request.POST:
             cohort = get_object_or_404(Cohort, id=int(request.POST['cohort']))
-            ctype = ContentType.objects.get_for_model(cohort.form.model)
-            member_subq = CohortMember.objects.filter(cohort=cohort,
-                                                      object_id=OuterRef('pk'))
-            members = []
-            for submission in queryset.exclude(Exists(member_subq)):
-                members.append(CohortMember(cohort=cohort, content_type=ctype,
-                                            object_id=submission.pk))
-            CohortMember.objects.bulk_create(members)
-            cohort.size = cohort.cohortmember_set.count()
-            cohort.save()
+            CohortMember.objects.add_members(cohort, queryset)
+            if cohort.panel:
+                PanelistProgress.objects.refresh(cohort.form,
+                                                 panel=cohort.panel)
             
             msg = f'Submissions added to cohort "{cohort.name}".'
             self.message_user(request, msg, messages.SUCCESS)
@@ -706,6 +924,37 @@ class FormSubmissionsAdmin(admin.ModelAdmin):
         }
         return TemplateResponse(request, template_name, context)
     
+    @admin.action(description='Partition submissions into panel cohorts')
+    def partition_cohorts(self, request, queryset):
+        fs, ps = self.model._meta.form_slug, self.model._meta.program_slug
+        program_form = Form.objects.get(slug=fs, program__slug=ps)
+        panels = Panel.objects.filter(program=program_form.program)
+        panels = list(panels.order_by('name'))
+        
+        form = PartitionForm(program_form=program_form, panels=panels)
+        if 'partition' in request.POST:
+            form = PartitionForm(program_form=program_form, panels=panels,
+                                 data=request.POST)
+            if form.is_valid():
+                data = form.cleaned_data
+                cohorts = Cohort.objects.partition(
+                    program_form, queryset, data['weights'], data['name'],
+                    reviews=data['reviews'], stratify=data['stratify'] or None
+                ) # inactive, so panelist progress is counted on activation
+                
+                sizes = ', '.join(f'"{c.name}" ({c.size})' for c in cohorts)
+                msg = f'Submissions partitioned into cohorts {sizes}.'
+                self.message_user(request, msg, messages.SUCCESS)
+                return HttpResponseRedirect(request.get_full_path())
+        
+        template_name = 'admin/reviewpanel/partition_cohorts.html'
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Partition into cohorts', 'opts': self.model._meta,
+            'media': self.media, 'submissions': queryset, 'form': form
+        }
+        return TemplateResponse(request, template_name, context)
+    
     @admin.action(description='Export submissions as CSV')
     def export_csv(self, request, queryset):
         metrics, program_form = self.get_metrics(request)
@@ -0,0 +1,126 @@
+from django.http import JsonResponse, HttpResponseRedirect
+from django.urls import reverse
+from django.views import generic
+from django.contrib.auth.mixins import LoginRequiredMixin
+
+from .templatetags.submission import dereference_block
+from .views import URL_PREFIX, FormObjectMixin, FormView, SubmissionView, \
+    SubmissionDetailView, ScoresFormView, assignment_data
+
+
+def item_data(item, fields):
+    data = {'id': item._id, 'fields': { f: getattr(item, f) for f in fields }}
+    if item._file:
+        data.update(file=item._file.url, meta=item._filemeta,
+                    thumbnail=item._artifact_url())
+    return data
+
+def section_data(section):
+    return {
+        'name': section.name, 'x': float(section.x), 'y': float(section.y),
+        'w': float(section.w), 'h': section.h and float(section.h),
+        'font': section.font, 'wrap': section.wrap, 'scroll': section.scroll
+    }
+
+
+class AssignmentView(LoginRequiredMixin, FormObjectMixin, generic.View):
+    raise_exception = True
+    
+    def get(self, request, *args, **kwargs):
+        form = self.get_object()
+        
+        name, object_id = FormView(request=request).assign(form, request.user)
+        if object_id: kwargs['pk'] = str(object_id)
+        return JsonResponse(assignment_data(name, kwargs))
+
+
+class SubmissionDataView(SubmissionDetailView):
+    raise_exception = True
+    
+    def render_to_response(self, context, **kwargs):
+        response = super().render_to_response(context, **kwargs)
+        if isinstance(response, HttpResponseRedirect): # no longer assigned
+            args = { k: self.kwargs[k] for k in self.kwargs if k != 'pk' }
+            return JsonResponse({'assigned': False,
+                                 'api': reverse(URL_PREFIX + 'api_form',
+                                                kwargs=args)})
+        
+        return JsonResponse(self.submission_data(context))
+    
+    def reference_data(self, context, ref):
+        data = {'id': ref.id, 'name': ref.id_string(),
+                'block_label': ref.block_label_html(),
+                'inline_label': ref.inline_label_html()}
+        if not ref.collection:
+            data['value'] = str(dereference_block(context, ref, self.object))
+            return data
+        
+        data.update(collection=ref.collection, field=ref.name or None,
+                    block_combine=ref.block_combine,
+                    inline_combine=ref.inline_combine)
+        return data
+    
+    def submission_data(self, context):
+        presentation, form = context['presentation'], context['form']
+        
+        sections, fields = [], {}
+        for section, refs, selectors in context['sections']:
+            data = section_data(section)
+            if section.name == presentation.inputs_section():
+                data['content'] = 'inputs'
+            elif section.name == presentation.metrics_section():
+                data['content'] = 'metrics'
+            else:
+                data['references'] = [ self.reference_data(context, ref)
+                                       for ref in refs ]
+                data['selectors'] = { c: [ ref.id for ref in v[0] ]
+                                      for c, v in selectors.items() }
+            sections.append(data)
+            
+            for ref in refs:
+                if not ref.collection or ref.is_file: continue
+                fields.setdefault(ref.collection, {})[ref.name] = True
+        
+        inputs = []
+        for input in form.inputs:
+            field = form.fields[input.name]
+            inputs.append({
+                'name': input.name, 'label': input.label, 'type': input.type,
+                'required': field.required, 'min': input.min_num,
+                'max': input.max_num, 'max_chars': input.max_chars,
+                'value': form.initial.get(input.name)
+            })
+        
+        stats = None
+        if presentation.show_stats():
+            progress = context['stats']
+            stats = {'scored': progress.scored, 'skipped': progress.skipped,
+                     'total': progress.total}
+        
+        min_seconds = presentation.min_seconds
+        if context['next_on']: min_seconds = 0 # already scored once
+        return {
+            'assigned': True, 'submission': self.object.pk,
+            'cohort': context['cohort'].id, 'presentation': presentation.id,
+            'min_seconds': min_seconds,
+            'prev_on': context['prev_on'], 'next_on': context['next_on'],
+            'sections': sections, 'inputs': inputs, 'stats': stats,
+            'prefetch': context['prefetch'],
+            'metrics': [ {'name': m.name, 'type': m.type,
+                          'count_value': m.count_value, 'value': v}
+                         for m, v in context['metrics'] ],
+            'items': { c: [ item_data(item, fields.get(c, {}))
+                            for item in items ]
+                       for c, items in context['items'].items() }
+        }
+
+
+class ScoresDataView(ScoresFormView):
+    raise_exception, json = True, True
+    
+    def form_invalid(self, form):
+        return JsonResponse({'errors': form.errors}, status=400)
+
+
+class ApiSubmissionView(SubmissionView):
+    detail_view, scores_view = SubmissionDataView, ScoresDataView
@@ -1,9 +1,11 @@
 from django import forms
 from django.contrib.admin import widgets
+from django.core.exceptions import FieldError
 
 from formative.forms import AdminJSONForm, ExportAdminForm, NegatedBooleanField
 from formative.models import FormBlock
-from .models import TemplateSection, Presentation, Input, Metric, Cohort
+from .models import TemplateSection, Presentation, Input, Metric, Cohort, \
+    CohortRule
 
 
 class ReferenceForm(AdminJSONForm):
@@ -93,9 +95,14 @@ class PresentationForm(AdminJSONForm):
     hide_stats = NegatedBooleanField(
         label='show progress stats', required=False
     )
+    prefetch_next = forms.BooleanField(
+        label='prefetch next submission', required=False,
+        help_text="Reserve each panelist's next submission while they view " \
+                  "the current one, and have the browser preload its media."
+    )
     
     class Meta:
-        json_fields = {'options': ['custom_css', 'hide_stats']}
+        json_fields = {'options': ['custom_css', 'hide_stats', 'prefetch_next']}
 
 
 class MetricForm(forms.ModelForm):
@@ -164,6 +171,34 @@ class CohortForm(forms.ModelForm):
         return cleaned_data
 
 
+class CohortRuleForm(forms.ModelForm):
+    class Meta:
+        help_texts = {
+            'conditions': 'A list of conditions that must all match, like ' \
+                          '[{"field": "items:images", "lookup": "gte", ' \
+                          '"value": 3}]. Fields are block names, ' \
+                          'items:collection or metric:input:metric. ' \
+                          'Add "negate": true to exclude the matches.'
+        }
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        conditions = cleaned_data.get('conditions')
+        
+        if not isinstance(conditions, list) or not all(
+            isinstance(c, dict) and 'field' in c for c in conditions
+        ):
+            self.add_error('conditions',
+                           'Must be a list of objects, each with a field.')
+            return cleaned_data
+        
+        rule = CohortRule(cohort=self.instance.cohort, conditions=conditions)
+        try: rule.matches()
+        except (TypeError, ValueError, FieldError) as e:
+            self.add_error('conditions', str(e))
+        return cleaned_data
+
+
 class CohortStatusForm(forms.Form):
     status = forms.ChoiceField(choices=Cohort.Status.choices[1:])
     message = forms.CharField(required=False,
@@ -217,6 +252,67 @@ class PresentationExportForm(forms.Form):
                                                    initial=True)
 
 
+class PartitionForm(forms.Form):
+    name = forms.CharField(max_length=40,
+                           help_text='Cohorts are named this and the panel.')
+    reviews = forms.IntegerField(min_value=1, initial=1,
+                                 label='panels per submission')
+    stratify = forms.ChoiceField(required=False)
+    
+    def __init__(self, program_form=None, panels=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.program_form, self.panels = program_form, panels or []
+        
+        blocks = program_form.custom_blocks().filter(page__gt=0)
+        self.fields['stratify'].choices = [('', 'none')] + [
+            (b.name, b.name) for b in blocks
+        ]
+        for panel in self.panels:
+            self.fields[f'weight_{panel.id}'] = forms.FloatField(
+                label=f'{panel.name} weight', min_value=0, initial=0,
+                help_text='Leave at zero to skip this panel.'
+            )
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        
+        weights = {}
+        for panel in self.panels:
+            weight = cleaned_data.get(f'weight_{panel.id}')
+            if weight: weights[panel] = weight
+        cleaned_data['weights'] = weights
+        
+        reviews = cleaned_data.get('reviews')
+        if not weights: self.add_error(None, 'Give a panel a nonzero weight.')
+        elif reviews and reviews > len(weights):
+            self.add_error('reviews', 'Cannot exceed the number of panels.')
+        
+        name = cleaned_data.get('name')
+        if not name: return cleaned_data
+        names = [ f'{name} {panel.name}' for panel in weights ]
+        cohorts = Cohort.objects.filter(form=self.program_form, name__in=names)
+        if any(len(n) > 50 for n in names):
+            self.add_error('name', 'Too long when combined with a panel name.')
+        elif cohorts.exists():
+            self.add_error('name', 'A cohort with this name already exists.')
+        return cleaned_data
+
+
+class ScoreImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV or ODS with a header row, or JSON '
+                                     'Lines, with fields panelist (the '
+                                     'email), submission, cohort, input, '
+                                     'value and (optionally) created.')
+    dry_run = forms.BooleanField(required=False, label='only validate')
+    file_types = ('csv', 'ods', 'jsonl') # pyexcel has plugins for these
+    
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if upload.name.rpartition('.')[2].lower() not in self.file_types:
+            raise forms.ValidationError('Must be a CSV, ODS or JSONL file.')
+        return upload
+
+
 class ScoresForm(forms.Form):
     def __init__(self, inputs=None, allow_skip=False, *args, **kwargs):
         self.inputs, self.allow_skip = inputs, allow_skip
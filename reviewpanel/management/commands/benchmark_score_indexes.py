@@ -0,0 +1,160 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.contrib import auth
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+from datetime import timedelta
+from random import randrange, choice
+from statistics import median
+import time
+import uuid
+
+from formative.models import Form
+from ...models import Score, Cohort
+
+
+INDEXES = ('score_placeholder_idx', 'score_history_idx',
+           'score_counted_idx')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare Score query plans and timings with and without the ' \
+           'composite indexes, on synthetic scores that are rolled back.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('program_slug')
+        parser.add_argument('form_slug')
+        parser.add_argument('--panelists', type=int, default=50)
+        parser.add_argument('--submissions', type=int, default=2000)
+        parser.add_argument('--scores', type=int, default=200000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--rounds', type=int, default=4,
+                            help='Rounds with and without the indexes, '
+                                 'alternating which goes first.')
+    
+    def handle(self, *args, **options):
+        try: form = Form.objects.get(program__slug=options['program_slug'],
+                                     slug=options['form_slug'])
+        except Form.DoesNotExist: raise CommandError('Form not found.')
+        
+        cohort = Cohort.objects.filter(form=form, inputs__isnull=False).first()
+        if not cohort: raise CommandError('Form needs a cohort with inputs.')
+        if not connection.features.can_rollback_ddl:
+            raise CommandError('The indexes are dropped in a transaction, '
+                               'so the database must support rolling back DDL.')
+        
+        try:
+            with transaction.atomic():
+                self.benchmark(form, cohort, options)
+                raise Rollback
+        except Rollback: pass
+    
+    def populate(self, form, cohort, options):
+        User = auth.get_user_model()
+        run = uuid.uuid4().hex[:8]
+        users = User.objects.bulk_create([
+            User(username=f'benchmark_{run}_{i}', email=f'{run}{i}@example.com')
+            for i in range(options['panelists'])
+        ])
+        ids = [ uuid.uuid4() for i in range(options['submissions']) ]
+        
+        ctype = ContentType.objects.get_for_model(form.model)
+        inputs, now = list(cohort.inputs.all()), timezone.now()
+        scores, created, seen = [], [], set()
+        month = 60 * 60 * 24 * 30
+        for i in range(options['scores']):
+            user, object_id, input = choice(users), choice(ids), choice(inputs)
+            if (user.pk, object_id, input.pk) in seen: continue
+            seen.add((user.pk, object_id, input.pk))
+            
+            value = None if not randrange(50) else randrange(6)
+            scores.append(Score(panelist=user, form=form, cohort=cohort,
+                                input=input, content_type=ctype,
+                                object_id=object_id, value=value))
+            created.append(now - timedelta(seconds=randrange(month)))
+        Score.objects.bulk_create(scores, batch_size=5000)
+        
+        # created is auto_now_add, so the spread over time is set afterwards
+        for score, timestamp in zip(scores, created): score.created = timestamp
+        Score.objects.bulk_update(scores, ['created'], batch_size=5000)
+        
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Score._meta.db_table}')
+        return users, ids, inputs
+    
+    def queries(self, form, cohort, users, ids, inputs):
+        user, input = users[0], inputs[0]
+        score = Score.objects.filter(panelist=user, form=form,
+                                     input=input).exclude(value=None).first()
+        
+        queries = {
+            'placeholder': Score.objects.placeholders().filter(
+                panelist=user, cohort__in=[cohort]
+            ).order_by('-created')[:1],
+            'counts': Score.objects.filter(form=form, input=input,
+                                           value__gt=0, object_id=ids[0])
+        }
+        if score:
+            history = Score.objects.filter(panelist=user, form=form,
+                                           input=input)
+            queries['history'] = history.filter(
+                Q(created__lt=score.created) |
+                Q(created=score.created) & Q(id__lt=score.id)
+            ).order_by('-created', '-id')[:1]
+        return queries
+    
+    def measure(self, queries, repeat):
+        # milliseconds per run of each query, after a warm-up run not counted
+        timings = {}
+        for name, queryset in queries.items():
+            list(queryset.all())
+            start = time.perf_counter()
+            for i in range(repeat): list(queryset.all())
+            timings[name] = (time.perf_counter() - start) / repeat * 1000
+        return timings
+    
+    def set_indexes(self, present):
+        indexes = [ i for i in Score._meta.indexes if i.name in INDEXES ]
+        with connection.schema_editor(atomic=False) as editor:
+            for index in indexes:
+                if present: editor.add_index(Score, index)
+                else: editor.remove_index(Score, index)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Score._meta.db_table}')
+    
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            return queryset.explain(analyze=True)
+        return queryset.explain()
+    
+    def benchmark(self, form, cohort, options):
+        users, ids, inputs = self.populate(form, cohort, options)
+        queries = self.queries(form, cohort, users, ids, inputs)
+        
+        timings, plans, indexed = { True: {}, False: {} }, {}, True
+        for i in range(options['rounds']):
+            # alternate which goes first, so neither always finds a warm cache
+            for present in (True, False) if i % 2 == 0 else (False, True):
+                if present != indexed: self.set_indexes(present)
+                indexed = present
+                
+                measured = self.measure(queries, options['repeat'])
+                for name, ms in measured.items():
+                    timings[present].setdefault(name, []).append(ms)
+                if present not in plans:
+                    plans[present] = { name: self.explain(queryset)
+                                       for name, queryset in queries.items() }
+        
+        for present in (True, False):
+            heading = 'With indexes:' if present else 'Without indexes:'
+            self.stdout.write(self.style.MIGRATE_HEADING(heading))
+            for name, runs in timings[present].items():
+                self.stdout.write(f'{name}: {median(runs):.3f} ms (median of '
+                                  f'{len(runs)} rounds)')
+                self.stdout.write(plans[present][name])
+                self.stdout.write('')
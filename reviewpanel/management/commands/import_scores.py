@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from formative.models import Form, Site
+from ...forms import ScoreImportForm
+from ...utils import ScoreImport
+
+
+class Command(BaseCommand):
+    help = 'Import scores from a spreadsheet with a header row, or JSON ' \
+           'Lines, with fields panelist (the email), submission, cohort, ' \
+           'input, value and (optionally) created.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('program_slug')
+        parser.add_argument('form_slug')
+        parser.add_argument('file', help='CSV, ODS or JSONL file.')
+        parser.add_argument('--site', help="Domain of the panelists' site, "
+                                           "if the program has several.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only validate the rows and report errors.')
+    
+    def handle(self, *args, **options):
+        try: form = Form.objects.get(program__slug=options['program_slug'],
+                                     slug=options['form_slug'])
+        except Form.DoesNotExist: raise CommandError('Form not found.')
+        if not form.model: raise CommandError('Form is not published.')
+        
+        sites = Site.objects.filter(programs=form.program)
+        if options['site']: sites = sites.filter(domain=options['site'])
+        if len(sites) != 1:
+            raise CommandError('Give the --site of one of the program\'s '
+                               'sites.')
+        
+        file_type = options['file'].rpartition('.')[2].lower()
+        if file_type not in ScoreImportForm.file_types:
+            raise CommandError('Must be a CSV, ODS or JSONL file.')
+        
+        score_import = ScoreImport(form, sites[0], dry_run=options['dry_run'])
+        try:
+            with open(options['file'], 'rb') as stream:
+                imported = score_import.import_file(file_type, stream)
+        except (OSError, *ScoreImport.read_errors) as e:
+            raise CommandError(f'Could not read the file, so no scores were '
+                               f'imported: {e}')
+        
+        for row, message in score_import.errors:
+            self.stderr.write(f'row {row}: {message}')
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(f'{verb} {imported} scores, with '
+                          f'{len(score_import.errors)} rows in error.')
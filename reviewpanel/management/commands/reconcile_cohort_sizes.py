@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Count, Subquery, OuterRef
+from django.db.models.functions import Coalesce
+
+from ...models import Cohort, CohortMember
+
+
+class Command(BaseCommand):
+    help = 'Recount the members of every cohort and correct stored sizes.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the cohorts that are off.')
+    
+    def handle(self, *args, **options):
+        members = CohortMember.objects.filter(cohort=OuterRef('pk'))
+        counts = members.order_by().values('cohort').annotate(n=Count('pk'))
+        actual = Coalesce(Subquery(counts.values('n')), 0)
+        
+        stale = Cohort.objects.annotate(actual=actual)
+        stale = stale.exclude(size=F('actual')).select_related('form')
+        for cohort in stale:
+            self.stdout.write(f'{cohort.form.slug} "{cohort.name}": '
+                              f'{cohort.size} stored, {cohort.actual} members')
+        if options['dry_run']: return
+        
+        fixed = Cohort.objects.filter(pk__in=stale.values('pk'))
+        updated = fixed.update(size=actual)
+        self.stdout.write(f'Corrected {updated} cohort sizes.')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Score
+
+
+class Command(BaseCommand):
+    help = 'Delete placeholder scores for assignments that have expired.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many would be deleted.')
+    
+    def handle(self, *args, **options):
+        expired = Score.objects.placeholders(live=False)
+        
+        if options['dry_run']:
+            count = expired.count()
+            self.stdout.write(f'{count} expired placeholders.')
+            return
+        
+        count, _ = expired.delete()
+        self.stdout.write(f'Deleted {count} expired placeholders.')
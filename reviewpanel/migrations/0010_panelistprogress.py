@@ -0,0 +1,32 @@
+# Generated by Django 4.0.6 on 2026-10-19 14:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formative', '0010_alter_user_options_user_site_user_uniq_site_email_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reviewpanel', '0009_alter_template_program_and_initial_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PanelistProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scored', models.PositiveIntegerField(default=0)),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('form', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='formative.form')),
+                ('panelist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='panelistprogress',
+            constraint=models.UniqueConstraint(fields=('panelist', 'form'), name='unique_panelist_form_progress'),
+        ),
+    ]
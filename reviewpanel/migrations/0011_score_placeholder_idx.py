@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviewpanel', '0010_panelistprogress'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='score',
+            index=models.Index(condition=models.Q(('value', None)), fields=['panelist', 'created'], name='score_placeholder_idx'),
+        ),
+    ]
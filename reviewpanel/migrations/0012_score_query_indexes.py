@@ -0,0 +1,21 @@
+# Generated by Django 4.0.6 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviewpanel', '0011_score_placeholder_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='score',
+            index=models.Index(fields=['panelist', 'form', 'input', 'created', 'id'], name='score_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='score',
+            index=models.Index(condition=models.Q(('value__gt', 0)), fields=['form', 'input', 'object_id'], name='score_counted_idx'),
+        ),
+    ]
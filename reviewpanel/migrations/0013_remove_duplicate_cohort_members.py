@@ -0,0 +1,33 @@
+# Generated by Django 4.0.6 on 2026-10-19 17:20
+
+from django.db import migrations
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_members(apps, schema_editor):
+    CohortMember = apps.get_model('reviewpanel', 'CohortMember')
+    Cohort = apps.get_model('reviewpanel', 'Cohort')
+    
+    members = CohortMember.objects.values('cohort', 'object_id')
+    duplicates = members.annotate(first=Min('id'), n=Count('id'))
+    for dup in duplicates.filter(n__gt=1):
+        CohortMember.objects.filter(
+            cohort=dup['cohort'], object_id=dup['object_id']
+        ).exclude(id=dup['first']).delete()
+    
+    counts = CohortMember.objects.filter(cohort=OuterRef('pk'))
+    counts = counts.values('cohort').annotate(c=Count('*')).values('c')
+    Cohort.objects.update(size=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviewpanel', '0012_score_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_members,
+                             migrations.RunPython.noop),
+    ]
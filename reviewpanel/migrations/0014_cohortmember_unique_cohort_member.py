@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-19 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviewpanel', '0013_remove_duplicate_cohort_members'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='cohortmember',
+            constraint=models.UniqueConstraint(fields=('cohort', 'object_id'), name='unique_cohort_member'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.6 on 2026-10-19 18:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviewpanel', '0014_cohortmember_unique_cohort_member'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohortRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('conditions', models.JSONField(blank=True, default=list)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('cohort', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rules', related_query_name='rule', to='reviewpanel.cohort')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='cohortrule',
+            constraint=models.UniqueConstraint(fields=('cohort', 'name'), name='unique_rule_name'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.6 on 2026-10-19 19:10
+
+from django.db import migrations
+from django.db.backends.utils import truncate_name
+
+
+def submission_tables(apps, schema_editor):
+    # submission tables are created outside of migrations, when a form is
+    # published, and named as formative's Form.model names them
+    Form = apps.get_model('formative', 'Form')
+    max_length = schema_editor.connection.ops.max_name_length()
+    
+    forms = Form.objects.exclude(status='draft').select_related('program')
+    for form in forms:
+        table = form.program.db_slug + '_' + form.db_slug
+        yield table, truncate_name(f'{table}_submitted_idx', max_length)
+
+def create_submitted_indexes(apps, schema_editor):
+    quote = schema_editor.quote_name
+    for table, name in submission_tables(apps, schema_editor):
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table)} '
+            '(_submitted DESC NULLS LAST, _id DESC)'
+        )
+
+def drop_submitted_indexes(apps, schema_editor):
+    quote = schema_editor.quote_name
+    for table, name in submission_tables(apps, schema_editor):
+        schema_editor.execute(f'DROP INDEX IF EXISTS {quote(name)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviewpanel', '0015_cohortrule'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_submitted_indexes, drop_submitted_indexes),
+    ]
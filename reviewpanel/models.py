@@ -1,14 +1,25 @@
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.core.exceptions import ValidationError, FieldError, \
+    FieldDoesNotExist
+from django.db import models, transaction, connection
+from django.db.backends.utils import truncate_name
 from django.db.models import UniqueConstraint, Subquery, OuterRef, Count, \
-    Avg, StdDev, Max, Min, Func, BooleanField
-from django.db.models.functions import Coalesce, Cast
+    Avg, StdDev, Max, Min, Func, BooleanField, F, Q, Exists
+from django.db.models.functions import Coalesce, Cast, Greatest
+from django.db.models.lookups import Exact
+from django.contrib import auth
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey, \
     GenericRelation
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
+from datetime import timedelta
+from functools import lru_cache
+import hashlib
 
 from formative.models import Program, Form, RankedModel
 from formative.utils import MarkdownFormatter, remove_p
@@ -16,6 +27,20 @@ from formative.utils import MarkdownFormatter, remove_p
 
 markdown = MarkdownFormatter()
 
+LAYOUT_CACHE_TIMEOUT = 60 * 60 * 24
+LABEL_CACHE_SIZE = 1024
+PLACEHOLDER_TTL = timedelta(seconds=getattr(settings,
+                                            'REVIEWPANEL_PLACEHOLDER_TTL',
+                                            60 * 60 * 12))
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def label_html(text, inline=False):
+    # labels repeat for every submission shown, and are keyed by their text
+    html = markdown.convert(text)
+    if inline: return remove_p(html)
+    return html
+
 
 class Template(models.Model):
     class Meta:
@@ -108,6 +133,83 @@ class Presentation(models.Model):
     def show_stats(self):
         if 'hide_stats' in self.options: return False
         return True
+    
+    def prefetch_next(self):
+        if 'prefetch_next' in self.options: return self.options['prefetch_next']
+        return False
+    
+    @staticmethod
+    def layout_version(pk):
+        key = f'reviewpanel_layout_version_{pk}'
+        version = cache.get(key)
+        if version is None:
+            # don't start over at 1 if the key was evicted; that could collide
+            cache.add(key, int(timezone.now().timestamp()), timeout=None)
+            version = cache.get(key)
+        return version
+    
+    def cache_dirty(self):
+        key = f'reviewpanel_layout_version_{self.pk}'
+        try: cache.incr(key)
+        except ValueError: self.layout_version(self.pk)
+    
+    def compile_layout(self):
+        references = self.references.select_related('section', 'select_section')
+        references = list(references.order_by('_rank'))
+        names = [ ref.name for ref in references if not ref.collection ]
+        cnames = [ ref.collection for ref in references if ref.collection ]
+        blocks = self.form.blocks.filter(Q(name__in=names) | Q(name__in=cnames))
+        
+        refs, select_refs = {}, {}
+        for ref in references:
+            refs.setdefault(ref.section.name, []).append(ref)
+            
+            if not ref.collection: continue
+            section = ref.select_section if ref.select_section else ref.section
+            section_refs = select_refs.setdefault(section.name, {})
+            collection = section_refs.setdefault(ref.collection, ([], []))
+            
+            if ref.is_file: collection[0].append(ref)
+            else: collection[1].append(ref)
+        
+        sections = []
+        for section in self.template.sections.order_by('-y'):
+            selectors = {}
+            # a map from collection to array of refs that want a selector here
+            if section.name in select_refs:
+                selectors = { col: (v[0]+v[1], bool(v[0])) # + whether have file
+                              for col, v in select_refs[section.name].items() }
+            sections.append((section,
+                             refs[section.name] if section.name in refs else [],
+                             selectors))
+        return {
+            'blocks': { b.name: b for b in blocks },
+            'collections': list(dict.fromkeys(cnames)), 'sections': sections
+        }
+    
+    def stylesheet(self):
+        # returns the layout's CSS and a digest of it, for a cacheable URL
+        version = self.layout_version(self.pk)
+        key = f'reviewpanel_layout_css_{self.pk}_{version}'
+        stylesheet = cache.get(key)
+        if stylesheet is None:
+            css = render_to_string('reviewpanel/layout.css', {
+                'presentation': self, 'template': self.template,
+                'sections': self.compiled_layout()['sections']
+            })
+            digest = hashlib.md5(css.encode()).hexdigest()[:16]
+            stylesheet = (css, digest)
+            cache.set(key, stylesheet, timeout=LAYOUT_CACHE_TIMEOUT)
+        return stylesheet
+    
+    def compiled_layout(self):
+        # references, sections and blocks only change when the admin edits them
+        key = f'reviewpanel_layout_{self.pk}_{self.layout_version(self.pk)}'
+        layout = cache.get(key)
+        if layout is None:
+            layout = self.compile_layout()
+            cache.set(key, layout, timeout=LAYOUT_CACHE_TIMEOUT)
+        return layout
 
 
 class Reference(RankedModel):
@@ -169,10 +271,10 @@ class Reference(RankedModel):
         return str
     
     def block_label_html(self):
-        return mark_safe(markdown.convert(self.block_label))
+        return mark_safe(label_html(self.block_label))
     
     def inline_label_html(self):
-        return mark_safe(remove_p(markdown.convert(self.inline_label)))
+        return mark_safe(label_html(self.inline_label, inline=True))
 
 
 class Input(RankedModel):
@@ -241,6 +343,20 @@ class Metric(models.Model):
     def __str__(self):
         return self.name
     
+    @staticmethod
+    def metrics_version():
+        version = cache.get('reviewpanel_metrics_version')
+        if version is None:
+            cache.add('reviewpanel_metrics_version',
+                      int(timezone.now().timestamp()), timeout=None)
+            version = cache.get('reviewpanel_metrics_version')
+        return version
+    
+    @staticmethod
+    def cache_dirty():
+        try: cache.incr('reviewpanel_metrics_version')
+        except ValueError: Metric.metrics_version()
+    
     def aggregate(self):
         if self.type == self.MetricType.COUNT: return Count
         elif self.type == self.MetricType.AVG: return Avg
@@ -293,6 +409,45 @@ class Panel(models.Model):
         return self.name
 
 
+class CohortManager(models.Manager):
+    def partition(self, form, queryset, weights, name, reviews=1,
+                  stratify=None):
+        # split submissions across one new cohort per panel, in proportion to
+        # the weights, placing each submission in `reviews` distinct cohorts
+        fields = ('pk', stratify) if stratify else ('pk',)
+        rows = queryset.order_by(*fields[::-1]).values_list(*fields)
+        
+        panels = list(weights)
+        totals, assigned = { p: 0 for p in panels }, { p: [] for p in panels }
+        stratum, counts = object(), { p: 0 for p in panels }
+        
+        def load(p): # furthest below its share, within the stratum then overall
+            return ((counts[p] + 1) / weights[p], (totals[p] + 1) / weights[p])
+        
+        for row in rows.iterator(chunk_size=5000):
+            if stratify and row[1] != stratum:
+                stratum, counts = row[1], { p: 0 for p in panels }
+            
+            for panel in sorted(panels, key=load)[:reviews]:
+                assigned[panel].append(row[0])
+                totals[panel] += 1
+                counts[panel] += 1
+        
+        ctype = ContentType.objects.get_for_model(form.model)
+        with transaction.atomic():
+            cohorts = self.bulk_create([
+                self.model(form=form, panel=panel, name=f'{name} {panel.name}',
+                           panel_weight=weights[panel], size=totals[panel])
+                for panel in panels
+            ])
+            CohortMember.objects.bulk_create((
+                CohortMember(cohort=cohort, content_type=ctype, object_id=pk)
+                for cohort, panel in zip(cohorts, panels)
+                for pk in assigned[panel]
+            ), batch_size=5000)
+        return cohorts
+
+
 class Cohort(models.Model):
     class Meta:
         constraints = [
@@ -328,31 +483,278 @@ class Cohort(models.Model):
     activated = models.DateTimeField(null=True, blank=True, editable=False)
     completed = models.DateTimeField(null=True, blank=True, editable=False)
     
+    objects = CohortManager()
+    
     def __str__(self):
         return self.name
     
     def members(self):
         cohort_members = Subquery(self.cohortmember_set.values('object_id'))
         return self.form.model.objects.filter(pk__in=cohort_members)
+    
+    def rule_matches(self):
+        # submissions matching any of the cohort's rules
+        rules, q = list(self.rules.all()), None
+        if not rules: return None
+        submitted = self.form.model.objects.filter(_submitted__isnull=False)
+        for rule in rules:
+            # a value that can't be compared with its field matches nothing
+            try: rule_q = Q(pk__in=rule.matches().values('pk'))
+            except (TypeError, ValueError, FieldError): continue
+            q = rule_q if q is None else q | rule_q
+        if q is None: return submitted.none()
+        return submitted.filter(q)
+    
+    def apply_rules(self, remove=False):
+        matches = self.rule_matches()
+        if matches is None: return 0, 0
+        
+        with transaction.atomic():
+            added = CohortMember.objects.add_members(self, matches)
+            removed = 0
+            if remove:
+                stale = self.cohortmember_set.exclude(
+                    object_id__in=matches.values('pk')
+                )
+                removed = CohortMember.objects.remove_members(stale)
+        return added, removed
+
+
+class CohortRule(models.Model):
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['cohort', 'name'], name='unique_rule_name')
+        ]
+    
+    LOOKUPS = ('exact', 'iexact', 'contains', 'icontains', 'in',
+               'gt', 'gte', 'lt', 'lte', 'isnull')
+    OPERAND_TYPES = {'number': (int, float), 'text': (str,),
+                     'true or false': (bool,)}
+    
+    cohort = models.ForeignKey(Cohort, models.CASCADE, related_name='rules',
+                               related_query_name='rule')
+    name = models.CharField(max_length=50)
+    # a list of {"field": ..., "lookup": ..., "value": ..., "negate": bool}
+    conditions = models.JSONField(default=list, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.name
+    
+    def clean(self):
+        if not self.cohort_id or not isinstance(self.conditions, list): return
+        
+        for condition in self.conditions:
+            if not isinstance(condition, dict) or \
+               not isinstance(condition.get('field'), str):
+                continue # the form reports these
+            error = self.operand_error(condition)
+            if error: raise ValidationError({'conditions': error})
+    
+    def operand_type(self, field):
+        # what a condition's value has to be for its field; None to not check
+        if field.startswith('items:') or field.startswith('metric:'):
+            return 'number'
+        try: model_field = self.cohort.form.model._meta.get_field(field)
+        except FieldDoesNotExist: return None # matches() will report it
+        
+        numeric = (models.IntegerField, models.FloatField, models.DecimalField)
+        if isinstance(model_field, numeric): return 'number'
+        if isinstance(model_field, models.BooleanField): return 'true or false'
+        if isinstance(model_field, (models.CharField, models.TextField)):
+            return 'text'
+        return None
+    
+    def operand_error(self, condition):
+        field, lookup = condition['field'], condition.get('lookup', 'exact')
+        value = condition.get('value')
+        if lookup == 'exact' and value is None: return None # same as isnull
+        
+        if lookup == 'isnull': kind = 'true or false'
+        else: kind = self.operand_type(field)
+        if lookup in ('contains', 'icontains') and kind not in ('text', None):
+            return f'{field}: {lookup} only applies to text.'
+        if not kind: return None
+        
+        if lookup == 'in' and not isinstance(value, list):
+            return f'{field}: in needs a list.'
+        types = self.OPERAND_TYPES[kind]
+        for v in value if lookup == 'in' else [value]:
+            # bool is an int in Python, but it isn't a number here
+            if not isinstance(v, types) or \
+               isinstance(v, bool) and bool not in types:
+                return f'{field}: {lookup} needs {kind}, not {v!r}.'
+        return None
+    
+    def annotate(self, queryset, name, field):
+        # fields are block names, items:<collection> or metric:<input>:<name>
+        form = self.cohort.form
+        if field.startswith('items:'):
+            subqs = form.model.objects.filter(pk=OuterRef('pk'),
+                                              _items___collection=field[6:])
+            counts = subqs.values('pk').annotate(c=Count('_items'))
+            count = Coalesce(Subquery(counts.values('c')), 0)
+            return queryset.annotate(**{name: count}), name
+        
+        if field.startswith('metric:'):
+            try: input_name, metric_name = field[7:].split(':')
+            except ValueError: raise ValueError(f'Invalid metric: {field}')
+            try: metric = Metric.objects.select_related('input').get(
+                input__form=form, input__name=input_name, name=metric_name
+            )
+            except Metric.DoesNotExist:
+                raise ValueError(f'Unknown metric: {field}')
+            annotation = metric.annotation(Score.objects.all(), object_id='pk')
+            return queryset.annotate(**{name: annotation}), name
+        
+        return queryset, field
+    
+    def matches(self, queryset=None):
+        if queryset is None:
+            model = self.cohort.form.model
+            queryset = model.objects.filter(_submitted__isnull=False)
+        
+        for i, condition in enumerate(self.conditions):
+            lookup = condition.get('lookup', 'exact')
+            if lookup not in self.LOOKUPS:
+                raise ValueError(f'Unknown lookup: {lookup}')
+            queryset, name = self.annotate(queryset, f'rule_{i}',
+                                           condition['field'])
+            
+            q = Q(**{f'{name}__{lookup}': condition.get('value')})
+            if condition.get('negate'): q = ~q
+            queryset = queryset.filter(q)
+        return queryset
+
+
+def submitted_index(model):
+    # supports listing a form's submissions (or cohort members) newest first
+    name = truncate_name(f'{model._meta.db_table}_submitted_idx',
+                         connection.ops.max_name_length())
+    return models.Index(F('_submitted').desc(nulls_last=True), F('_id').desc(),
+                        name=name)
+
+
+class CohortMemberManager(models.Manager):
+    def members_page(self, cohort, before=None, size=100):
+        # newest submissions first, walking the index on the submission table
+        # and continuing after the (submitted, id) of the previous page's last
+        model = cohort.form.model
+        members = self.filter(cohort=cohort, object_id=OuterRef('pk'))
+        submissions = model.objects.filter(Exists(members))
+        if before:
+            submitted, object_id = before
+            if submitted is None: q = Q(_submitted=None, pk__lt=object_id)
+            else: q = Q(_submitted__lt=submitted) | Q(_submitted=None) | \
+                      Q(_submitted=submitted, pk__lt=object_id)
+            submissions = submissions.filter(q)
+        
+        fields = ['pk', '_submitted']
+        if hasattr(model, '_email'): fields.append('_email')
+        submissions = submissions.order_by(
+            F('_submitted').desc(nulls_last=True), '-pk'
+        ).values(*fields)[:size]
+        
+        rows = list(submissions)
+        members = self.filter(cohort=cohort,
+                              object_id__in=[ row['pk'] for row in rows ])
+        members = { member.object_id: member for member in members }
+        page = []
+        for row in rows:
+            if row['pk'] not in members: continue # removed in between
+            member = members[row['pk']]
+            member.cohort, member.submitted = cohort, row['_submitted']
+            if '_email' in row: member.email = row['_email']
+            page.append(member)
+        return page
+    
+    def add_members(self, cohort, queryset):
+        # one INSERT ... SELECT of the submission pks, skipping existing members
+        ctype = ContentType.objects.get_for_model(queryset.model)
+        subq = queryset.order_by().values('pk').query
+        sql, params = subq.sql_with_params()
+        
+        table = self.model._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (cohort_id, content_type_id, object_id) '
+                f'SELECT %s, %s, submission.* FROM ({sql}) submission '
+                'ON CONFLICT (cohort_id, object_id) DO NOTHING',
+                (cohort.pk, ctype.pk, *params)
+            )
+            added = cursor.rowcount
+            
+            cohorts = Cohort.objects.filter(pk=cohort.pk)
+            if added: cohorts.update(size=F('size') + added)
+        return added
+    
+    def remove_members(self, queryset):
+        # delete the memberships, and take each cohort's share off its size
+        with transaction.atomic():
+            counts = queryset.order_by().values('cohort')
+            counts = list(counts.annotate(n=Count('pk')))
+            
+            removed, _ = queryset.delete()
+            for count in counts:
+                cohorts = Cohort.objects.filter(pk=count['cohort'])
+                cohorts.update(size=Greatest(F('size') - count['n'], 0))
+        return removed
 
 
 class CohortMember(models.Model):
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['cohort', 'object_id'],
+                             name='unique_cohort_member')
+        ]
+    
     cohort = models.ForeignKey(Cohort, models.CASCADE)
     content_type = models.ForeignKey(ContentType, models.CASCADE)
     object_id = models.UUIDField(db_index=True)
     member = GenericForeignKey()
     
+    objects = CohortMemberManager()
+    
     def __str__(self):
         if self.cohort.form.validation_type == Form.Validation.EMAIL:
+            if hasattr(self, 'email'): return self.email # annotated listings
             return self.member._email
         
-        return self.object_id
+        return str(self.object_id)
 
 
 class ScoreManager(models.Manager):
+    def placeholders(self, live=True):
+        # an assignment that's not scored within the TTL has been abandoned
+        cutoff = timezone.now() - PLACEHOLDER_TTL
+        if live: return self.filter(value=None, created__gte=cutoff)
+        return self.filter(value=None, created__lt=cutoff)
+    
     def create_for_cohort(self, user, cohort, **extra_fields):
         return self.model(panelist=user, form=cohort.form, cohort=cohort,
                           **extra_fields)
+    
+    def bulk_upsert(self, scores, fields=('value', 'text', 'created')):
+        # one INSERT, updating in place the rows that hit the unique constraint
+        if not scores: return
+        quote, opts = connection.ops.quote_name, self.model._meta
+        columns = [ f for f in opts.concrete_fields if not f.primary_key ]
+        
+        row = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        params = [ f.get_db_prep_save(getattr(score, f.attname), connection)
+                   for score in scores for f in columns ]
+        updates = ', '.join(f'{quote(opts.get_field(name).column)} = '
+                            f'EXCLUDED.{quote(opts.get_field(name).column)}'
+                            for name in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(opts.db_table)} '
+                f'({", ".join(quote(f.column) for f in columns)}) '
+                f'VALUES {", ".join([row] * len(scores))} '
+                'ON CONFLICT ON CONSTRAINT '
+                'unique_panelist_submission_cohort_input '
+                f'DO UPDATE SET {updates}', params
+            )
 
 
 class Score(models.Model):
@@ -362,6 +764,14 @@ class Score(models.Model):
                                      'cohort', 'input'],
                              name='unique_panelist_submission_cohort_input')
         ]
+        indexes = [
+            models.Index(fields=['panelist', 'created'],
+                         condition=Q(value=None), name='score_placeholder_idx'),
+            models.Index(fields=['panelist', 'form', 'input', 'created', 'id'],
+                         name='score_history_idx'),
+            models.Index(fields=['form', 'input', 'object_id'],
+                         condition=Q(value__gt=0), name='score_counted_idx')
+        ]
     
     panelist = models.ForeignKey(settings.AUTH_USER_MODEL, models.SET_NULL,
                                  null=True, blank=True, related_name='scores',
@@ -388,3 +798,104 @@ class Score(models.Model):
         elif not self.value: return name + 'skip'
         elif self.input.type == Input.InputType.TEXT: return name + 'score'
         return name + f'score={self.value}'
+
+
+
+class ProgressManager(models.Manager):
+    def refresh(self, form, panel=None, panelist=None, panelists=None):
+        # recount, for the panelists on the form's panels (or a subset of them)
+        users = auth.get_user_model().objects.filter(panel__cohort__form=form)
+        if panel: users = users.filter(panel=panel)
+        if panelist: users = users.filter(pk=panelist.pk)
+        user_ids = set(users.values_list('pk', flat=True))
+        if panelist: user_ids.add(panelist.pk)
+        # given ids may be off the form's panels now, and have their rows zeroed
+        if panelists is not None: user_ids = set(panelists)
+        user_ids.discard(None) # scores from deleted users have no panelist
+        
+        active = {'cohort__form': form, 'cohort__status': Cohort.Status.ACTIVE}
+        panelists = 'cohort__panel__panelists'
+        members = CohortMember.objects.filter(**{panelists + '__in': user_ids},
+                                              **active)
+        member_counts = members.values(panelists).annotate(
+            n=Count('object_id', distinct=True)
+        )
+        totals = { c[panelists]: c['n'] for c in member_counts }
+        
+        through = Cohort.inputs.through
+        input_q = through.objects.filter(cohort=OuterRef('cohort'))
+        primary = Subquery(input_q.order_by('input___rank').values('input')[:1])
+        qs = Score.objects.filter(value__isnull=False, panelist__in=user_ids,
+                                  cohort__panel__panelists=F('panelist'),
+                                  **active)
+        scored = qs.annotate(pri=primary,
+                             skip=Exact(F('value'), 0)).filter(input=F('pri'))
+        counts = {}
+        for c in scored.values('panelist', 'skip').annotate(c=Count('*')):
+            user_counts = counts.setdefault(c['panelist'], {False: 0, True: 0})
+            user_counts[c['skip']] += c['c']
+        
+        with transaction.atomic():
+            existing = self.select_for_update().filter(form=form,
+                                                       panelist__in=user_ids)
+            rows = { p.panelist_id: p for p in existing }
+            for user_id in user_ids:
+                user_counts = counts.get(user_id, {False: 0, True: 0})
+                row = rows.setdefault(user_id, self.model(panelist_id=user_id,
+                                                          form=form))
+                row.scored, row.skipped = user_counts[False], user_counts[True]
+                row.total = totals.get(user_id, 0)
+            
+            new = [ row for row in rows.values() if not row.pk ]
+            self.bulk_update([ row for row in rows.values() if row.pk ],
+                             ['scored', 'skipped', 'total'])
+            self.bulk_create(new, ignore_conflicts=True)
+    
+    def panelists(self, cohorts):
+        # ids of the users whose counts depend on these cohorts
+        users = auth.get_user_model().objects.filter(panel__cohort__in=cohorts)
+        return set(users.values_list('pk', flat=True))
+    
+    def for_panelist(self, user, form):
+        # a missing row, or one whose counts can't add up, is recounted
+        progress = self.filter(panelist=user, form=form).first()
+        if progress and progress.scored + progress.skipped <= progress.total:
+            return progress
+        
+        self.refresh(form, panelist=user)
+        return self.get(panelist=user, form=form)
+    
+    def record(self, user, form, old_value, new_value):
+        # adjust the counters for a primary score going from old to new value
+        def counter(value):
+            if value is None: return None
+            return value and 'scored' or 'skipped'
+        
+        old, new = counter(old_value), counter(new_value)
+        if old == new: return
+        
+        updates = {}
+        if old: updates[old] = F(old) - 1
+        if new: updates[new] = F(new) + 1
+        if not self.filter(panelist=user, form=form).update(**updates):
+            self.refresh(form, panelist=user)
+
+
+class PanelistProgress(models.Model):
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['panelist', 'form'],
+                             name='unique_panelist_form_progress')
+        ]
+    
+    panelist = models.ForeignKey(settings.AUTH_USER_MODEL, models.CASCADE,
+                                 related_name='+')
+    form = models.ForeignKey(Form, models.CASCADE, related_name='+')
+    scored = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    
+    objects = ProgressManager()
+    
+    def __str__(self):
+        return f'{self.panelist} {self.form}'
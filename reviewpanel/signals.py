@@ -1,12 +1,16 @@
+from django.db import connection
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
 
 from formative.admin import site
-from formative.models import Program, Form
+from formative.models import Program, Form, FormBlock
 from formative.signals import form_published_changed, register_user_actions, \
-    all_submissions_pre_delete, all_forms_unpublish
+    all_submissions_pre_delete, all_forms_publish, all_forms_unpublish
 from .admin import add_to_panel, ProgramFormsAdmin, FormSubmissionsAdmin
-from .models import CohortMember, Score
+from .models import Template, TemplateSection, Presentation, Reference, \
+    Input, Metric, Panel, Cohort, CohortMember, Score, PanelistProgress, \
+    submitted_index
 
 
 programs_registered, forms_registered = {}, {}
@@ -57,13 +61,120 @@ def all_submissions_pre_delete(sender, instance, **kwargs):
         if model._meta.db_table == sender._meta.db_table: match = True
     if not match: return # all_forms_unpublish has already taken care of it
     
-    CohortMember.objects.filter(object_id=instance.pk).delete()
-    Score.objects.filter(object_id=instance.pk).delete()
+    forms = Form.objects.filter(cohort__cohortmember__object_id=instance.pk)
+    forms = list(forms.distinct())
+    members = CohortMember.objects.filter(object_id=instance.pk)
+    cohorts = Cohort.objects.filter(cohortmember__in=members)
+    # only the panelists of its cohorts, or who scored it, have counts to fix
+    panelists = PanelistProgress.objects.panelists(cohorts)
+    scores = Score.objects.filter(object_id=instance.pk)
+    scorers = scores.exclude(panelist=None)
+    panelists.update(scorers.values_list('panelist', flat=True))
+    
+    CohortMember.objects.remove_members(members)
+    scores.delete()
+    for form in forms:
+        PanelistProgress.objects.refresh(form, panelists=panelists)
+
+def panelists_progress(panel_ids, user_ids):
+    forms = Form.objects.filter(cohort__panel__in=panel_ids).distinct()
+    for form in forms:
+        PanelistProgress.objects.refresh(form, panelists=user_ids)
+
+@receiver(m2m_changed, sender=Panel.panelists.through,
+          dispatch_uid='reviewpanel_panelists_changed')
+def panelists_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear': # by post_clear, there's no telling who it was
+        related = instance.panels if reverse else instance.panelists
+        instance._reviewpanel_cleared = set(related.values_list('pk',
+                                                                flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_reviewpanel_cleared', set())
+    elif action not in ('post_add', 'post_remove'): return
+    
+    if reverse: panelists_progress(pk_set, {instance.pk})
+    else: panelists_progress({instance.pk}, pk_set)
+
+@receiver(post_save, sender=Panel.panelists.through,
+          dispatch_uid='reviewpanel_panelist_save')
+@receiver(post_delete, sender=Panel.panelists.through,
+          dispatch_uid='reviewpanel_panelist_delete')
+def panelist_changed(sender, instance, **kwargs):
+    # the panel admin's inline saves and deletes the rows themselves
+    user_field = Panel.panelists.field.m2m_reverse_field_name()
+    panelists_progress({instance.panel_id},
+                       {getattr(instance, user_field + '_id')})
+
+@receiver(all_forms_publish, dispatch_uid='reviewpanel_form_publish')
+def all_forms_publish(sender, content_type, **kwargs):
+    form = sender
+    model = form.model # sent for the item model as well, which isn't indexed
+    if content_type.model.lower() == model.__name__.lower():
+        with connection.schema_editor() as editor:
+            editor.add_index(model, submitted_index(model))
 
 @receiver(all_forms_unpublish, dispatch_uid='reviewpanel_form_unpublish')
 def all_forms_unpublish(sender, content_type, **kwargs):
     form = sender
-    CohortMember.objects.filter(content_type=content_type).delete()
+    members = CohortMember.objects.filter(content_type=content_type)
+    CohortMember.objects.remove_members(members)
     Score.objects.filter(content_type=content_type).delete()
+    PanelistProgress.objects.filter(form=form).delete()
     
     # TODO: deactivate any active cohorts
+
+@receiver(post_save, sender=Presentation,
+          dispatch_uid='reviewpanel_presentation_save')
+@receiver(post_delete, sender=Presentation,
+          dispatch_uid='reviewpanel_presentation_delete')
+def presentation_changed(sender, instance, **kwargs):
+    instance.cache_dirty()
+
+@receiver(post_save, sender=Reference,
+          dispatch_uid='reviewpanel_reference_save')
+@receiver(post_delete, sender=Reference,
+          dispatch_uid='reviewpanel_reference_delete')
+def reference_changed(sender, instance, **kwargs):
+    Presentation(pk=instance.presentation_id).cache_dirty()
+
+@receiver(post_save, sender=Template, dispatch_uid='reviewpanel_template_save')
+def template_changed(sender, instance, **kwargs):
+    presentations = Presentation.objects.filter(template=instance.pk)
+    for presentation in presentations.only('pk'): presentation.cache_dirty()
+
+@receiver(post_save, sender=TemplateSection,
+          dispatch_uid='reviewpanel_section_save')
+@receiver(post_delete, sender=TemplateSection,
+          dispatch_uid='reviewpanel_section_delete')
+def template_section_changed(sender, instance, **kwargs):
+    presentations = Presentation.objects.filter(template=instance.template_id)
+    for presentation in presentations.only('pk'): presentation.cache_dirty()
+
+def form_block_changed(sender, instance, **kwargs):
+    presentations = Presentation.objects.filter(form=instance.form_id)
+    for presentation in presentations.only('pk'): presentation.cache_dirty()
+
+def block_models(model=FormBlock):
+    # signals are sent for the concrete class saved, not for its parents
+    yield model
+    for subclass in model.__subclasses__(): yield from block_models(subclass)
+
+for block_model in block_models():
+    post_save.connect(form_block_changed, sender=block_model,
+                      dispatch_uid='reviewpanel_block_save')
+    post_delete.connect(form_block_changed, sender=block_model,
+                        dispatch_uid='reviewpanel_block_delete')
+
+@receiver(post_save, sender=Metric, dispatch_uid='reviewpanel_metric_save')
+@receiver(post_delete, sender=Metric, dispatch_uid='reviewpanel_metric_delete')
+@receiver(post_save, sender=Input, dispatch_uid='reviewpanel_input_save')
+@receiver(post_delete, sender=Input, dispatch_uid='reviewpanel_input_delete')
+@receiver(post_delete, sender=Cohort, dispatch_uid='reviewpanel_cohort_delete')
+def metrics_changed(sender, **kwargs):
+    Metric.cache_dirty()
+
+@receiver(m2m_changed, sender=Cohort.inputs.through,
+          dispatch_uid='reviewpanel_cohort_inputs_changed')
+def cohort_inputs_changed(sender, action, **kwargs):
+    if action.startswith('post_'): Metric.cache_dirty()
@@ -133,3 +133,7 @@ if (timer) {
     setTimeout(dec, 1000);
   })();
 }
+
+let scoresForm = document.querySelector('div.inputs form');
+if (scoresForm && scoresForm.getAttribute('action')) // next one, shown in place
+  history.replaceState(null, '', scoresForm.getAttribute('action'));
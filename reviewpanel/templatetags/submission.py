@@ -1,26 +1,48 @@
 from django import template
+from functools import lru_cache
 
 
 register = template.Library()
 
+@lru_cache(maxsize=256)
+def layout_accessors(presentation_id, layout_version):
+    # filled in by dereference_block; kept per process for each layout version,
+    # since the accessors are closures that can't go in the shared cache
+    return {}
+
 @register.simple_tag
 def collection_items(items, collection):
     return items[collection]
 
+def block_accessor(block, field=''):
+    # resolve the attribute names and renderer once, for many submissions
+    block_type = block.block_type()
+    if block_type == 'custom':
+        name = block.name
+        return lambda submission: getattr(submission, name) or ''
+    elif block_type == 'stock':
+        stock = block.stock
+        names = [ (n, stock.field_name(n)) for n in stock.widget_names() ]
+        render = stock.render
+        
+        def accessor(submission):
+            return render(field, **{ n: getattr(submission, attr)
+                                     for n, attr in names })
+        return accessor
+    return lambda submission: ''
+
 @register.simple_tag(takes_context=True)
 def dereference_block(context, ref, submission):
     block_name = ref.name if not ref.collection else ref.collection
     if not block_name: return ''
-    block = context['blocks'][block_name]
     
-    if block.block_type() == 'custom':
-        return getattr(submission, block_name) or ''
-    elif block.block_type() == 'stock':
-        stock = block.stock
-        values = { n: getattr(submission, stock.field_name(n))
-                   for n in stock.widget_names() }
-        return stock.render(ref.field, **values)
-    return ''
+    # the context can carry accessors compiled for earlier refs or submissions
+    accessors, key = context.get('accessors'), (block_name, ref.field)
+    if accessors is None: accessors = {}
+    if key not in accessors:
+        accessors[key] = block_accessor(context['blocks'][block_name],
+                                        ref.field)
+    return accessors[key](submission)
 
 @register.simple_tag
 def dereference_item_field(ref, item):
@@ -1,7 +1,8 @@
 from django.urls import path, include
 
 from .views import ProgramView, FormView, FormInfoView, SubmissionView, \
-    SubmissionAdminView, PresentationAdminView
+    SubmissionAdminView, PresentationAdminView, LayoutStyleView
+from .api import AssignmentView, ApiSubmissionView
 
 
 review_patterns = [
@@ -19,8 +20,15 @@ review_patterns = [
         path('<uuid:pk>/<int:presentation>/', SubmissionAdminView.as_view(),
              name='submission_admin'),
         path('<int:presentation>/', PresentationAdminView.as_view(),
-             name='presentation_admin')
+             name='presentation_admin'),
+        path('api/', AssignmentView.as_view(), name='api_form'),
+        path('api/<uuid:pk>/', ApiSubmissionView.as_view(),
+             name='api_submission'),
+        path('api/<uuid:pk>/skips', ApiSubmissionView.as_view(skips=True),
+             name='api_submission_skips')
     ])),
+    path('style/<int:presentation>/<slug:digest>.css',
+         LayoutStyleView.as_view(), name='layout_css'),
     path('<slug:slug>/', ProgramView.as_view(), name='program_index'),
     path('', ProgramView.as_view(show_all=True), name='index')
 ]
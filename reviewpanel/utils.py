@@ -1,16 +1,30 @@
+from django.contrib import auth
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import Subquery
 from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 import pyexcel
+from pyexcel.exceptions import FileTypeNotSupported
+from pyexcel_io.exceptions import NoSupportingPluginFound
 from reportlab.pdfgen import canvas as pdfgen_canvas
 from reportlab.lib import units, styles
 from reportlab import platypus
 from urllib.parse import quote
 from itertools import groupby
+import csv
+import json
 import re
+import uuid
+import zipfile
 
 from formative.utils import TabularExport
-from .models import Score, Input, Metric
-from .templatetags.submission import dereference_block
+from .forms import ScoresForm
+from .models import Score, Input, Metric, Panel, Cohort, PanelistProgress, \
+    Presentation
+from .templatetags.submission import dereference_block, layout_accessors
 
 
 class MetricsTabularExport(TabularExport):
@@ -145,6 +159,11 @@ class PresentationPrintExport:
         names = Subquery(self.references.filter(collection='').values('name'))
         self.blocks = { b.name: b for b
                         in presentation.form.blocks.filter(name__in=names) }
+        version = Presentation.layout_version(presentation.pk)
+        self.block_context = {
+            'blocks': self.blocks,
+            'accessors': layout_accessors(presentation.pk, version)
+        }
     
     def apps_per_page(self, canvas):
         # TODO
@@ -168,7 +187,7 @@ class PresentationPrintExport:
             if ref.collection: continue # TODO
             section = content.setdefault(ref.section.name, [])
             blabel, ilabel = ref.block_label, ref.inline_label
-            val = dereference_block({'blocks': self.blocks}, ref, app)
+            val = dereference_block(self.block_context, ref, app)
             section.append(((blabel, ilabel), val))
         
         for sec_name, vals in content.items():
@@ -249,3 +268,157 @@ class PresentationPrintExport:
         disp = f"attachment; filename*=UTF-8''" + quote(self.filename)
         response['Content-Disposition'] = disp
         return response
+
+
+class ScoreImport:
+    columns = ('panelist', 'submission', 'cohort', 'input', 'value')
+    # what reading a malformed file can raise (UnicodeDecodeError included)
+    read_errors = (ValueError, csv.Error, zipfile.BadZipFile,
+                   FileTypeNotSupported, NoSupportingPluginFound)
+    chunk_size = 2000
+    
+    def __init__(self, program_form, site, dry_run=False):
+        self.program_form, self.site = program_form, site
+        self.dry_run, self.errors, self.imported = dry_run, [], 0
+        self.ctype = ContentType.objects.get_for_model(program_form.model)
+        
+        # each cohort's inputs, validated by the fields panelists would use
+        self.cohorts, self.fields = {}, {}
+        cohorts = Cohort.objects.filter(form=program_form)
+        for cohort in cohorts.prefetch_related('inputs'):
+            inputs = list(cohort.inputs.all())
+            form = ScoresForm(inputs=inputs, allow_skip=cohort.allow_skip)
+            self.cohorts[cohort.name] = cohort
+            self.fields[cohort.name] = {
+                input.name: (input, form.fields[input.name]) for input in inputs
+            }
+    
+    @staticmethod
+    def jsonl_records(stream):
+        for row, line in enumerate(stream, start=1):
+            if not line.strip(): continue
+            try: yield row, json.loads(line)
+            except ValueError: yield row, None
+    
+    def records(self, file_type, stream):
+        # (row number, dict) pairs, from a binary file
+        if file_type == 'jsonl': return self.jsonl_records(stream)
+        
+        # dicts keyed by the header row, so data starts at row 2
+        records = pyexcel.iget_records(file_type=file_type,
+                                       file_content=stream.read())
+        return enumerate(records, start=2)
+    
+    def import_file(self, file_type, stream):
+        # all or nothing, so a file that turns out to be unreadable part way
+        # through (raising one of read_errors) leaves no scores behind
+        try:
+            with transaction.atomic():
+                return self.run(self.records(file_type, stream))
+        finally: pyexcel.free_resources()
+    
+    def run(self, records):
+        chunk = []
+        for row, record in records:
+            chunk.append((row, record))
+            if len(chunk) < self.chunk_size: continue
+            self.import_chunk(chunk)
+            chunk = []
+        if chunk: self.import_chunk(chunk)
+        
+        if self.imported and not self.dry_run:
+            PanelistProgress.objects.refresh(self.program_form)
+        return self.imported
+    
+    def import_chunk(self, chunk):
+        # all of the chunk's panelists, submissions and panels in three queries
+        def cell(record, name):
+            val = record.get(name)
+            return '' if val is None else str(val).strip()
+        
+        records = []
+        for row, record in chunk:
+            if isinstance(record, dict): records.append((row, record))
+            else: self.errors.append((row, 'Not a JSON object.'))
+        chunk = records
+        
+        # formative users are identified by email, within their site
+        emails = { cell(record, 'panelist') for row, record in chunk }
+        users = auth.get_user_model().objects.filter(site=self.site,
+                                                     email__in=emails)
+        self.users = dict(users.values_list('email', 'pk'))
+        
+        ids = set()
+        for row, record in chunk:
+            try: ids.add(uuid.UUID(cell(record, 'submission')))
+            except ValueError: pass
+        submissions = self.program_form.model.objects.filter(
+            pk__in=ids, _submitted__isnull=False
+        )
+        self.submissions = set(submissions.values_list('pk', flat=True))
+        
+        memberships = Panel.panelists.through.objects.filter(
+            user__in=self.users.values()
+        )
+        self.panelists = set(memberships.values_list('user', 'panel'))
+        
+        scores = {}
+        for row, record in chunk:
+            try: score = self.score({ name: cell(record, name)
+                                      for name in self.columns + ('created',) })
+            except ValidationError as e:
+                self.errors.append((row, ' '.join(e.messages)))
+                continue
+            # a later row for the same score replaces the earlier one
+            key = (score.panelist_id, score.object_id, score.cohort_id,
+                   score.input_id)
+            scores[key] = score
+        
+        if not self.dry_run: Score.objects.bulk_upsert(list(scores.values()))
+        self.imported += len(scores)
+    
+    def score(self, vals):
+        for name in self.columns:
+            if name != 'value' and not vals[name]:
+                raise ValidationError(f'Missing {name}.')
+        
+        if vals['cohort'] not in self.cohorts:
+            raise ValidationError(f'Unknown cohort "{vals["cohort"]}".')
+        cohort = self.cohorts[vals['cohort']]
+        if vals['input'] not in self.fields[cohort.name]:
+            raise ValidationError(f'Input "{vals["input"]}" is not scored '
+                                  f'in cohort "{cohort.name}".')
+        input, field = self.fields[cohort.name][vals['input']]
+        
+        if vals['panelist'] not in self.users:
+            raise ValidationError(f'No user with email "{vals["panelist"]}" '
+                                  'on this site.')
+        panelist = self.users[vals['panelist']]
+        if (panelist, cohort.panel_id) not in self.panelists:
+            raise ValidationError(f'"{vals["panelist"]}" is not on the '
+                                  'panel for this cohort.')
+        
+        try: object_id = uuid.UUID(vals['submission'])
+        except ValueError: raise ValidationError('Invalid submission ID.')
+        if object_id not in self.submissions:
+            raise ValidationError('No submitted submission with this ID.')
+        
+        created = timezone.now()
+        if vals['created']:
+            try: created = parse_datetime(vals['created'])
+            except ValueError: created = None
+            if not created: raise ValidationError('Invalid created time.')
+            if timezone.is_naive(created):
+                created = timezone.make_aware(created)
+        
+        # the same rules, and conversion, as scores entered by panelists
+        python_val, text = field.clean(vals['value']), ''
+        if input.type == Input.InputType.TEXT:
+            if not python_val: raise ValidationError('Text value is empty.')
+            value, text = 1, python_val
+        else: value = int(python_val or 0) # zero for skipped
+        
+        return Score(panelist_id=panelist, form=self.program_form,
+                     cohort=cohort, input=input, content_type=self.ctype,
+                     object_id=object_id, value=value, text=text,
+                     created=created)
@@ -1,7 +1,13 @@
-from django.http import HttpResponseRedirect, HttpResponseBadRequest
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, \
+    HttpResponseBadRequest, JsonResponse
 from django.views import generic
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.core.cache import cache
+from django.db import transaction
 from django.core.paginator import Paginator
-from django.db.models import F, Q, Count, Exists, Subquery, OuterRef
+from django.db.models import F, Q, Count, Max, Exists, Subquery, OuterRef
 from django.db.models.functions import Coalesce
 from django.db.models.lookups import Exact
 from django.urls import reverse
@@ -10,15 +16,106 @@ from django.contrib import auth
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
 from random import random
+import hashlib
 
 from formative.models import Program, Form
 from .forms import ScoresForm
-from .models import Cohort, CohortMember, Score, Input, Metric, Presentation
+from .models import Cohort, CohortMember, Score, Input, Metric, Presentation, \
+    PanelistProgress, LAYOUT_CACHE_TIMEOUT
+from .templatetags.submission import layout_accessors
 
 
 URL_PREFIX = 'plugins:reviewpanel:'
 SCORES_PER_PAGE = 50
+RESERVATION_TIMEOUT = 60 * 30
+STYLESHEET_MAX_AGE = 60 * 60 * 24 * 365
+
+
+def wants_json(request):
+    return request.headers.get('Accept', '').startswith('application/json')
+
+def reservation_key(user, form):
+    return f'reviewpanel_next_{user.pk}_{form.pk}'
+
+def assignment_data(name, kwargs):
+    data = {'url': reverse(URL_PREFIX + name, kwargs=kwargs),
+            'submission': kwargs.get('pk'), 'skips': name == 'submission_skips',
+            'complete': name == 'form_complete'}
+    if 'pk' in kwargs:
+        data['api'] = reverse(URL_PREFIX + 'api_' + name, kwargs=kwargs)
+    return data
+
+def submission_state(request, program_slug, form_slug, pk=None,
+                     presentation=None, **kwargs):
+    # what a submission page depends on, for conditional GET; None to skip it
+    if request.method not in ('GET', 'HEAD') or not pk: return None
+    if hasattr(request, 'reviewpanel_state'): return request.reviewpanel_state
+    request.reviewpanel_state = None
+    if not request.user.is_authenticated: return None
+    
+    form = Form.objects.filter(program__slug=program_slug, slug=form_slug)
+    form = form.first()
+    if not form: return None
+    submissions = form.model.objects.filter(pk=pk)
+    modified = submissions.values_list('_modified', flat=True).first()
+    if not modified: return None
+    
+    # the page's form has a CSRF token, so a new cookie means a new page
+    # inputs' labels and bounds, and which a cohort uses, bump metrics_version
+    state = {'csrf': request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+             'modified': modified, 'last_modified': modified,
+             'inputs': Metric.metrics_version()}
+    if presentation is not None: # staff preview with a given presentation
+        state['layouts'] = [(presentation,
+                             Presentation.layout_version(presentation))]
+    else:
+        # a denied panelist must not get a 304, so check what permitted() does
+        entries = CohortMember.objects.filter(
+            object_id=pk, cohort__panel__panelists=request.user
+        ).exclude(cohort__status=Cohort.Status.INACTIVE)
+        if not entries.exists(): return None
+        
+        scores = Score.objects.filter(panelist=request.user, form=form)
+        latest = scores.aggregate(latest=Max('created'), count=Count('*'))
+        cohorts = scores.filter(object_id=pk).values_list(
+            'cohort', 'cohort__status', 'cohort__allow_skip',
+            'cohort__presentation'
+        ).distinct().order_by('cohort')
+        progress = PanelistProgress.objects.filter(panelist=request.user,
+                                                   form=form)
+        
+        state.update(latest, cohorts=list(cohorts), progress=list(
+            progress.values_list('scored', 'skipped', 'total')
+        ))
+        state['layouts'] = [ (c[3], Presentation.layout_version(c[3]))
+                             for c in state['cohorts'] if c[3] ]
+        if latest['latest']:
+            state['last_modified'] = max(modified, latest['latest'])
+    
+    request.reviewpanel_state = state
+    return state
+
+def submission_etag(request, *args, **kwargs):
+    state = submission_state(request, *args, **kwargs)
+    if not state: return None
+    
+    return hashlib.md5(repr(sorted(state.items())).encode()).hexdigest()
+
+def submission_last_modified(request, *args, **kwargs):
+    state = submission_state(request, *args, **kwargs)
+    if not state: return None
+    return state['last_modified']
+
+# pages are revalidated on each load or back-navigation, and cheaply
+submission_conditional = [
+    cache_control(private=True, no_cache=True),
+    condition(etag_func=submission_etag,
+              last_modified_func=submission_last_modified)
+]
 
 
 class ProgramView(LoginRequiredMixin, generic.DetailView):
@@ -122,11 +219,20 @@ class FormInfoView(LoginRequiredMixin, FormObjectMixin, generic.DetailView):
 
 class FormView(LoginRequiredMixin, generic.RedirectView, FormObjectMixin):
     permanent = False
+    # the panelist's cohorts for the form, and the inputs of any of them, when
+    # a scoring view has them loaded already
+    loaded_cohorts, loaded_inputs = None, None
     
     def panelist_cohorts(self, user):
         # find the cohorts with unseen apps reviewed by panels this user is on
-        cohorts = Cohort.objects.filter(status=Cohort.Status.ACTIVE,
-                                        form=self.object, panel__panelists=user)
+        if self.loaded_cohorts is not None:
+            cohorts = Cohort.objects.filter(pk__in=[
+                c.pk for c in self.loaded_cohorts
+                if c.status == Cohort.Status.ACTIVE
+            ])
+        else: cohorts = Cohort.objects.filter(status=Cohort.Status.ACTIVE,
+                                              form=self.object,
+                                              panel__panelists=user)
         
         members_subq = CohortMember.objects.filter(cohort=OuterRef('pk'))
         
@@ -158,10 +264,21 @@ class FormView(LoginRequiredMixin, generic.RedirectView, FormObjectMixin):
             if r < v: return cohort
         return cohort
     
+    def primary_input(self, cohort):
+        if self.loaded_inputs and cohort.pk in self.loaded_inputs:
+            return self.loaded_inputs[cohort.pk][0]
+        return cohort.inputs.order_by('_rank')[0]
+    
     def get_redirect_url(self, *args, **kwargs):
         self.object = self.get_object()
-        form, user = self.object, self.request.user
         
+        name, object_id = self.assign(self.object, self.request.user)
+        if object_id: kwargs['pk'] = str(object_id)
+        return reverse(URL_PREFIX + name, kwargs=kwargs)
+    
+    def assign(self, form, user):
+        # returns the URL name and the submission, if any, to send the user to
+        self.object = form
         active_cohorts, cohorts = self.panelist_cohorts(user)
         
         cohort = self.choose_panel(user, cohorts)
@@ -170,27 +287,55 @@ class FormView(LoginRequiredMixin, generic.RedirectView, FormObjectMixin):
             skipped = scores.filter(panelist=user, value=0,
                                     cohort__in=active_cohorts).order_by('?')
             skipped = skipped.exclude(input__type=Input.InputType.BOOLEAN)[:1]
-            if not skipped:
-                return reverse(URL_PREFIX + 'form_complete', kwargs=kwargs)
-            kwargs['pk'] = str(skipped[0].object_id)
-            return reverse(URL_PREFIX + 'submission_skips', kwargs=kwargs)
-        
-        unscored = None
-        try: unscored = Score.objects.get(panelist=user, value=None,
-                                          cohort__in=active_cohorts)
-        except Score.DoesNotExist: pass
+            if not skipped: return 'form_complete', None
+            return 'submission_skips', skipped[0].object_id
+        
+        placeholders = Score.objects.placeholders().select_related('cohort')
+        unscored = placeholders.filter(
+            panelist=user, cohort__in=active_cohorts
+        ).order_by('-created').first()
+        if not unscored:
+            # expired ones could collide with the placeholder about to be made
+            expired = Score.objects.placeholders(live=False)
+            expired.filter(panelist=user, form=form).delete()
+            
+            reserved = self.take_reservation(form, user, cohorts)
+            if reserved: return 'submission', reserved
         
         if unscored: cohort, unscored_id = unscored.cohort, unscored.object_id
         else: unscored_id = None
+        cohort.form = form
+        
+        input = self.primary_input(cohort)
+        apps = self.candidates(form, user, cohort, cohorts, input)
+        apps = apps.annotate(put_first=Exact(F('object_id'), unscored_id))
+        chosen, first = None, None
+        for member in apps.order_by('-put_first', 'scores', '?')[:2]:
+            if member.put_first:
+                first = member
+                continue
+            lowest_count = member.scores
+            if first and unscored:
+                if first.scores <= lowest_count: chosen = first
+                else: unscored.delete() # panelist waited; it will come up later
+            if not chosen: chosen = member
+        if not chosen: chosen = first
         
+        if chosen != first:
+            score = Score.objects.create_for_cohort(
+                user, cohort, input=input, object_id=chosen.object_id,
+                content_type_id=chosen.content_type_id
+            )
+            score.save()
+        return 'submission', chosen.object_id
+    
+    def candidates(self, form, user, cohort, cohorts, input):
         # TODO: seen on primary input, only
         user_seen = Score.objects.exclude(value=None).filter(panelist=user)
         active_user_seen = user_seen.filter(cohort__status=Cohort.Status.ACTIVE)
         members_seen = active_user_seen.values('object_id')
         
-        input = cohort.inputs.order_by('_rank')[0]
-        scores = Score.objects.filter(value__gt=0,
-                                      form=cohort.form, input=input)
+        scores = Score.objects.filter(value__gt=0, form=form, input=input)
         app_scores = scores.filter(object_id=OuterRef('object_id'))
         app_counts = app_scores.values('object_id').annotate(count=Count('*'))
         counts, members = app_counts.values('count'), cohort.cohortmember_set
@@ -201,90 +346,103 @@ class FormView(LoginRequiredMixin, generic.RedirectView, FormObjectMixin):
         cohort_apps = app_members.filter(app_cohort=cohort.pk)
         
         not_seen = cohort_apps.exclude(object_id__in=Subquery(members_seen))
-        apps = not_seen.annotate(scores=Coalesce(Subquery(counts), 0),
-                                 put_first=Exact(F('object_id'), unscored_id))
-        chosen, first = None, None
-        for member in apps.order_by('-put_first', 'scores', '?')[:2]:
-            if member.put_first:
-                first = member
-                continue
-            lowest_count = member.scores
-            if first and unscored:
-                if first.scores <= lowest_count: chosen = first
-                else: unscored.delete() # panelist waited; it will come up later
-            if not chosen: chosen = member
-        if not chosen: chosen = first
+        return not_seen.annotate(scores=Coalesce(Subquery(counts), 0))
+    
+    def reserve(self, form, user, current_id):
+        # choose what would follow the current submission, without assigning it
+        self.object = form
+        active_cohorts, cohorts = self.panelist_cohorts(user)
         
-        score = Score.objects.create_for_cohort(user, cohort, input=input,
-                                                submission=chosen.member)
-        if chosen != first: score.save()
-        kwargs['pk'] = str(chosen.object_id)
-        return reverse('plugins:reviewpanel:submission', kwargs=kwargs)
+        cohort = self.choose_panel(user, cohorts)
+        if not cohort: return None
+        cohort.form = form
+        
+        input = self.primary_input(cohort)
+        apps = self.candidates(form, user, cohort, cohorts, input)
+        apps = apps.exclude(object_id=current_id).order_by('scores', '?')
+        member = apps.first()
+        if not member: return None
+        return cohort, member
+    
+    def take_reservation(self, form, user, cohorts):
+        # a reservation is only a hint; it's assigned only if assign() could
+        # have chosen it now: still in its cohort's share, and a lowest count
+        key = reservation_key(user, form)
+        reserved = cache.get(key)
+        if not reserved: return None
+        cache.delete(key)
+        
+        cohort_id, object_id, prefetch = reserved
+        cohort = cohorts.filter(pk=cohort_id).first()
+        if not cohort: return None
+        cohort.form = form
+        
+        input = self.primary_input(cohort)
+        apps = self.candidates(form, user, cohort, cohorts, input)
+        member = apps.filter(object_id=object_id).first()
+        if not member: return None # seen, or rebalanced to another cohort
+        lowest = apps.order_by('scores').values_list('scores', flat=True)[0]
+        if member.scores > lowest: return None
+        
+        score = Score.objects.create_for_cohort(
+            user, cohort, input=input, object_id=object_id,
+            content_type_id=member.content_type_id
+        )
+        score.save()
+        return object_id
 
 
 class SubmissionObjectMixin(generic.detail.SingleObjectMixin):
     context_object_name = 'submission'
     
     def get_queryset(self):
-        form = get_object_or_404(Form.objects.select_related('program'),
-                                 program__slug=self.kwargs['program_slug'],
-                                 slug=self.kwargs['form_slug'])
-        
-        form.model, form.item_model
+        form = getattr(self, 'program_form', None)
+        if not form: # unless it was handed over from the scoring view
+            form = get_object_or_404(Form.objects.select_related('program'),
+                                     program__slug=self.kwargs['program_slug'],
+                                     slug=self.kwargs['form_slug'])
+            
+            form.model, form.item_model
+            self.program_form = form
         return form.model.objects.all()
 
 
 class PresentationContextMixin:
-    def presentation_context(self, pres):
-        form, references = pres.form, pres.references.order_by('_rank')
-        names = Subquery(references.filter(collection='').values('name'))
-        cnames = Subquery(references.exclude(collection='').values('collection'))
-        blocks = form.blocks.filter(Q(name__in=names) | Q(name__in=cnames))
-        
-        items = {}
-        if self.object and form.item_model:
-            citems = self.object._items.filter(_collection__in=cnames)
-            items = self.object._collections(queryset=citems, form=form)
-        
-        refs, select_refs = {}, {}
-        for ref in references:
-            refs.setdefault(ref.section.name, []).append(ref)
-            
-            if not ref.collection: continue
-            if ref.collection not in items: items[ref.collection] = []
-            section = ref.select_section if ref.select_section else ref.section
-            section_refs = select_refs.setdefault(section.name, {})
-            collection = section_refs.setdefault(ref.collection, ([], []))
-            
-            if ref.is_file: collection[0].append(ref)
-            else: collection[1].append(ref)
-        
-        sections = []
-        for section in pres.template.sections.order_by('-y'):
-            selectors = {}
-            # a map from collection to array of refs that want a selector here
-            if section.name in select_refs:
-                selectors = { col: (v[0]+v[1], bool(v[0])) # + whether have file
-                              for col, v in select_refs[section.name].items() }
-            sections.append((section,
-                             refs[section.name] if section.name in refs else [],
-                             selectors))
+    def presentation_context(self, pres, submission=None):
+        layout = pres.compiled_layout()
+        form = getattr(self, 'program_form', None)
+        if not form or form.pk != pres.form_id: form = pres.form
+        if not submission: submission = self.object
+        
+        def collection_items(): # not needed if the sections come from cache
+            items = {}
+            if submission and form.item_model:
+                cnames = layout['collections']
+                citems = submission._items.filter(_collection__in=cnames)
+                items = submission._collections(queryset=citems, form=form)
+            for collection in layout['collections']:
+                if collection not in items: items[collection] = []
+            return items
+        
+        version = Presentation.layout_version(pres.pk)
         return {
-            'blocks': { b.name: b for b in blocks },
-            'items': items, 'sections': sections
+            'blocks': layout['blocks'], 'sections': layout['sections'],
+            'accessors': layout_accessors(pres.pk, version),
+            'items': SimpleLazyObject(collection_items),
+            'layout_version': version,
+            'layout_css': pres.stylesheet()[1],
+            'fragment_timeout': LAYOUT_CACHE_TIMEOUT
         }
             
     
+@method_decorator(submission_conditional, name='get')
 class SubmissionDetailView(LoginRequiredMixin, SubmissionObjectMixin,
                            generic.DetailView, PresentationContextMixin):
     template_name = 'reviewpanel/submission.html'
+    form_action, bound_form = None, None
     
     def render_to_response(self, context, **kwargs):
-        user = self.request.user
-        entries = CohortMember.objects.filter(object_id=self.object.pk,
-                                              cohort__panel__panelists=user)
-        if not entries.exclude(cohort__status=Cohort.Status.INACTIVE).exists():
-            return self.handle_no_permission()
+        if not self.permitted(): return self.handle_no_permission()
         
         if 'cohort' not in context:
             kwargs = { k: self.kwargs[k] for k in self.kwargs if k != 'pk' }
@@ -293,14 +451,21 @@ class SubmissionDetailView(LoginRequiredMixin, SubmissionObjectMixin,
         
         return super().render_to_response(context, **kwargs)
     
+    def permitted(self):
+        user = self.request.user
+        entries = CohortMember.objects.filter(object_id=self.object.pk,
+                                              cohort__panel__panelists=user)
+        return entries.exclude(cohort__status=Cohort.Status.INACTIVE).exists()
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        score, prev, user = None, None, self.request.user
+        prev, user = None, self.request.user
         prev_on, next_on = False, False
         
         scores = Score.objects.filter(object_id=self.object.pk, panelist=user)
-        try: score = scores.get(value=None) # placeholder for an assigned member
-        except Score.DoesNotExist: pass
+        placeholders = Score.objects.placeholders().select_related('cohort')
+        score = placeholders.filter(object_id=self.object.pk,
+                                    panelist=user).first() # assigned member
         
         query = scores.filter(cohort__status=Cohort.Status.ACTIVE)
         try: prev = query.exclude(value=None).order_by('-created')[:1].get()
@@ -319,27 +484,13 @@ class SubmissionDetailView(LoginRequiredMixin, SubmissionObjectMixin,
             prev_on, next_on = prior.exists(), True
         if not score: return context # TODO: allow link sharing option
         
-        query = Cohort.objects.select_related('presentation__template')
+        query = Cohort.objects.select_related('presentation__template',
+                                              'presentation__form')
         cohort = query.get(pk=score.cohort_id)
-        form, inputs = cohort.presentation.form, cohort.inputs.order_by('_rank')
-        
-        apps = CohortMember.objects.filter(cohort__panel__panelists=user,
-                                           cohort__status=Cohort.Status.ACTIVE,
-                                           cohort__form=form)
-        apps_count = apps.values('object_id').distinct().count()
+        form = cohort.presentation.form
+        inputs = list(cohort.inputs.order_by('_rank'))
         
-        through = Cohort.inputs.through
-        input_q = through.objects.filter(cohort=OuterRef('cohort'))
-        primary = Subquery(input_q.order_by('input___rank').values('input')[:1])
-        qs = Score.objects.filter(value__isnull=False, panelist=user, form=form,
-                                  cohort__panel__panelists=user,
-                                  cohort__status=Cohort.Status.ACTIVE)
-        scored = qs.annotate(pri=primary,
-                             skip=Exact(F('value'), 0)).filter(input=F('pri'))
-        scored_counts = scored.values('skip').annotate(c=Coalesce(Count('*'),
-                                                                  0))
-        counts = {False: 0, True: 0}
-        for c in scored_counts.values('skip', 'c'): counts[c['skip']] += c['c']
+        progress = PanelistProgress.objects.for_panelist(user, form)
         
         initial = {}
         if score.value is not None:
@@ -347,8 +498,10 @@ class SubmissionDetailView(LoginRequiredMixin, SubmissionObjectMixin,
                 val = score.value
                 if score.input.type == Input.InputType.TEXT: val = score.text
                 if val: initial[score.input.name] = val
-        scores_form = ScoresForm(inputs=inputs, allow_skip=cohort.allow_skip,
-                                 initial=initial)
+        scores_form = self.bound_form # if it's shown again, with its errors
+        if not scores_form:
+            scores_form = ScoresForm(inputs=inputs, initial=initial,
+                                     allow_skip=cohort.allow_skip)
         
         metrics, count_max = [], 0
         if inputs:
@@ -372,23 +525,57 @@ class SubmissionDetailView(LoginRequiredMixin, SubmissionObjectMixin,
                               if m[0].type == count_type and m[0].count_value ]
             if metrics: count_max = max(metric_counts)
         
+        prefetch = []
+        if cohort.presentation.prefetch_next() and not next_on:
+            prefetch = self.prefetch_next()
+        
         context.update(self.presentation_context(cohort.presentation))
         context.update({
             'cohort': cohort, 'presentation': cohort.presentation,
             'template': cohort.presentation.template, 'form': scores_form,
             'prev_on': prev_on, 'next_on': next_on,
-            'metrics': metrics, 'count_max': count_max,
-            'stats': {'scored': counts[False], 'skipped': counts[True],
-                      'total': apps_count}
+            'metrics': metrics, 'count_max': count_max, 'stats': progress,
+            'form_action': self.form_action, 'prefetch': prefetch
         })
         return context
+    
+    def prefetch_next(self):
+        # reserve the next assignment while this one is viewed, and warm it up
+        key = reservation_key(self.request.user, self.program_form)
+        reserved = cache.get(key)
+        if reserved and reserved[1] != self.object.pk: return reserved[2]
+        
+        assigner = FormView(request=self.request, kwargs=self.kwargs)
+        reserved = assigner.reserve(self.program_form, self.request.user,
+                                    self.object.pk)
+        if not reserved: return []
+        cohort, member = reserved
+        
+        prefetch, presentation = [], cohort.presentation
+        if presentation:
+            model = self.program_form.model
+            try: submission = model.objects.get(pk=member.object_id)
+            except model.DoesNotExist: return []
+            
+            # video and audio are left out; browsers only fetch ranges of them
+            context = self.presentation_context(presentation, submission)
+            for items in context['items'].values():
+                for item in items:
+                    if not item._file or not item._filemeta: continue
+                    if item._filemeta.get('type') not in ('image', 'document'):
+                        continue
+                    prefetch.append(item._file.url)
+        
+        cache.set(key, (cohort.pk, member.object_id, prefetch),
+                  timeout=RESERVATION_TIMEOUT)
+        return prefetch
 
 
 class ScoresFormView(LoginRequiredMixin, SubmissionObjectMixin,
                      generic.FormView):
     template_name = 'reviewpanel/submission.html'
     form_class = ScoresForm
-    skips = False
+    skips, json = False, False
     
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
@@ -398,8 +585,19 @@ class ScoresFormView(LoginRequiredMixin, SubmissionObjectMixin,
         return kwargs
     
     def form_invalid(self, form):
-        # shouldn't be possible unless there's form tampering
-        return HttpResponseRedirect(request.get_full_path())
+        if form.non_field_errors(): # scored too soon; show it again
+            if self.json or wants_json(self.request):
+                return JsonResponse({'errors': form.errors}, status=400)
+            return self.show_again(form)
+        # otherwise shouldn't be possible unless there's form tampering
+        return HttpResponseRedirect(self.request.get_full_path())
+    
+    def show_again(self, form):
+        view = SubmissionDetailView(form_action=self.request.get_full_path(),
+                                    bound_form=form)
+        view.setup(self.request, **self.kwargs)
+        view.program_form = self.program_form
+        return view.get(self.request, **self.kwargs)
     
     def navigate_history(self, queryset, score, prev=False):
         qs = queryset
@@ -413,77 +611,183 @@ class ScoresFormView(LoginRequiredMixin, SubmissionObjectMixin,
     def form_valid(self, form):
         user, program_form = self.request.user, self.cohort.form
         
-        score, pri_input = None, None
-        for i, input in enumerate(self.inputs):
-            ctype = ContentType.objects.get_for_model(program_form.model)
-            args = {'content_type': ctype, 'form': program_form}
-            python_val, args['text'] = form.cleaned_data[input.name], ''
-            args['created'] = timezone.now()
-            if input.type == Input.InputType.TEXT:
-                args['value'], args['text'] = int(bool(python_val)), python_val
-            else: args['value'] = int(python_val)
-            
-            kwargs = {'panelist': user, 'object_id': self.submission.pk,
-                      'cohort': self.cohort, 'input': input}
-            if not i:
-                pri_input = input
-                program_form, id = self.cohort.form, self.submission.pk
-                try: score = Score.objects.get(**kwargs)
-                except Score.DoesNotExist: return HttpResponseBadRequest()
-                
-                if score.value != args['value'] or score.text != args['text']:
-                    score.created = args['created']
-                    score.value, score.text = args['value'], args['text']
-                    score.save()
-            elif input.type == Input.InputType.TEXT and not python_val:
-                Score.objects.filter(**kwargs).delete()
-            else: Score.objects.update_or_create(defaults=args, **kwargs)
+        with transaction.atomic():
+            score = self.save_scores(form)
+        if form.errors: return self.form_invalid(form)
+        if not score: return HttpResponseBadRequest()
         
         request = self.request
         nav = 'prev_scored' in request.POST or 'next_scored' in request.POST
         if nav and not self.skips:
             qs = Score.objects.filter(panelist=user, form=program_form,
-                                      input=pri_input)
+                                      input=score.input_id)
             previous = 'prev_scored' in request.POST
             target = self.navigate_history(qs, score, prev=previous)
             
             if not target:
                 self.kwargs.pop('pk')
-                url = reverse(URL_PREFIX + 'form_index', kwargs=self.kwargs)
-            else:
-                self.kwargs['pk'] = target.object_id
-                url = reverse(URL_PREFIX + 'submission', kwargs=self.kwargs)
-            return HttpResponseRedirect(url)
+                return self.redirect('form_index', self.kwargs)
+            self.kwargs['pk'] = str(target.object_id)
+            return self.redirect('submission', self.kwargs)
         
         # get another random submission to review
         self.kwargs.pop('pk')
-        return FormView.as_view()(self.request, **self.kwargs)
+        return self.advance()
+    
+    def redirect(self, name, kwargs):
+        if self.json or wants_json(self.request):
+            return JsonResponse(assignment_data(name, kwargs))
+        return HttpResponseRedirect(reverse(URL_PREFIX + name, kwargs=kwargs))
+    
+    def advance(self):
+        # assign and show the next submission, without another request cycle,
+        # from the cohorts and inputs the save loaded
+        inputs = getattr(self, 'inputs', None)
+        assigner = FormView(request=self.request, kwargs=self.kwargs,
+                            loaded_cohorts=self.cohorts.values(),
+                            loaded_inputs=inputs and {self.cohort.pk: inputs})
+        name, object_id = assigner.assign(self.program_form, self.request.user)
+        
+        kwargs = self.kwargs.copy()
+        if object_id: kwargs['pk'] = str(object_id)
+        if not object_id or self.json or wants_json(self.request):
+            return self.redirect(name, kwargs)
+        url = reverse(URL_PREFIX + name, kwargs=kwargs)
+        
+        view = SubmissionDetailView(form_action=url)
+        view.setup(self.request, **kwargs)
+        view.program_form = self.program_form
+        return view.get(self.request, **kwargs)
+    
+    def viewed_long_enough(self, placeholder, now):
+        # the placeholder was created when the submission was served
+        presentation = self.cohort.presentation
+        if not presentation or not presentation.min_seconds: return True
+        elapsed = now - placeholder.created
+        return elapsed.total_seconds() >= presentation.min_seconds
+    
+    def reassign(self, input, ctype):
+        # make the placeholder again if the submission is still in the cohort;
+        # its timer restarts, as if the page had only now been served
+        members = self.cohort.cohortmember_set
+        if not members.filter(object_id=self.submission.pk).exists():
+            return None
+        
+        score = Score.objects.create_for_cohort(
+            self.request.user, self.cohort, input=input, content_type=ctype,
+            object_id=self.submission.pk
+        )
+        score.save()
+        return score
+    
+    def save_scores(self, form):
+        user, program_form = self.request.user, self.cohort.form
+        # the form from the URL has its model built already; cohort's doesn't
+        ctype = ContentType.objects.get_for_model(self.program_form.model)
+        now = timezone.now()
+        
+        existing = Score.objects.select_for_update().filter(
+            panelist=user, object_id=self.submission.pk, cohort=self.cohort
+        )
+        existing = { score.input_id: score for score in existing }
+        
+        primary, scores, cleared = None, [], []
+        for i, input in enumerate(self.inputs):
+            python_val, text = form.cleaned_data[input.name], ''
+            if input.type == Input.InputType.TEXT:
+                value, text = int(bool(python_val)), python_val
+            else: value = int(python_val)
+            
+            score = existing.get(input.id)
+            if not i:
+                if not score: # swept after its TTL while the page was open
+                    score = self.reassign(input, ctype)
+                    if not score: return None # it was never assigned
+                first = score.value is None
+                if first and not self.viewed_long_enough(score, now):
+                    seconds = self.cohort.presentation.min_seconds
+                    form.add_error(None, f'Please review the submission for '
+                                         f'at least {seconds} seconds.')
+                    return None # sooner than the page's timer would allow
+                primary = score
+                if score.value == value and score.text == text: continue
+                PanelistProgress.objects.record(user, program_form,
+                                                score.value, value)
+            elif input.type == Input.InputType.TEXT and not python_val:
+                if score: cleared.append(score.pk)
+                continue
+            
+            if not score:
+                score = Score.objects.create_for_cohort(
+                    user, self.cohort, input=input, content_type=ctype,
+                    object_id=self.submission.pk
+                )
+            score.value, score.text, score.created = value, text, now
+            scores.append(score)
+        
+        # rows another submit of the same form just added are updated, too
+        Score.objects.bulk_upsert(scores)
+        if cleared: Score.objects.filter(pk__in=cleared).delete()
+        return primary
     
     def post(self, request, *args, **kwargs):
         self.submission = self.get_object()
         
         if 'cohort_id' not in request.POST: return HttpResponseBadRequest()
         
-        try: self.cohort = Cohort.objects.get(pk=int(request.POST['cohort_id']),
-                                              panel__panelists=request.user)
+        try: cohort_id = int(request.POST['cohort_id'])
         except ValueError: return HttpResponseBadRequest()
-        if self.cohort.status != Cohort.Status.ACTIVE: # this will redir to an
+        
+        # all of the panelist's cohorts for the form; assigning next uses them
+        cohorts = Cohort.objects.select_related('form', 'presentation')
+        cohorts = cohorts.filter(form=self.program_form,
+                                 panel__panelists=request.user)
+        self.cohorts = { cohort.pk: cohort for cohort in cohorts }
+        if cohort_id not in self.cohorts: return HttpResponseBadRequest()
+        self.cohort = self.cohorts[cohort_id]
+        if self.cohort.status != Cohort.Status.ACTIVE: # this will go to an
             self.kwargs.pop('pk') # app in cohort still active, or form_complete
-            return FormView.as_view()(self.request, **self.kwargs)
+            return self.advance()
         
         return super().post(request, *args, **kwargs)
 
 
 class SubmissionView(generic.View):
+    detail_view, scores_view = SubmissionDetailView, ScoresFormView
     skips = False
     
     def get(self, request, *args, **kwargs):
-        return SubmissionDetailView.as_view()(request, *args, **kwargs)
+        return self.detail_view.as_view()(request, *args, **kwargs)
     
     def post(self, req, *args, **kwargs):
-        return ScoresFormView.as_view(skips=self.skips)(req, *args, **kwargs)
+        return self.scores_view.as_view(skips=self.skips)(req, *args, **kwargs)
+
+
+class LayoutStyleView(LoginRequiredMixin, generic.View):
+    def get(self, request, *args, **kwargs):
+        query = Presentation.objects.select_related('template')
+        presentation = get_object_or_404(query, pk=kwargs['presentation'])
+        
+        user = request.user
+        if not user.is_staff:
+            cohorts = Cohort.objects.filter(form=presentation.form_id,
+                                            panel__panelists=user)
+            if not cohorts.exists(): return self.handle_no_permission()
+        
+        css, digest = presentation.stylesheet()
+        if digest != kwargs['digest']: # changed since the page was rendered
+            args = {'presentation': presentation.pk, 'digest': digest}
+            return HttpResponseRedirect(reverse(URL_PREFIX + 'layout_css',
+                                                kwargs=args))
+        
+        # the URL changes with the content, so it can be cached indefinitely
+        response = HttpResponse(css, content_type='text/css')
+        patch_cache_control(response, private=True, max_age=STYLESHEET_MAX_AGE,
+                            immutable=True)
+        return response
 
 
+@method_decorator(submission_conditional, name='get')
 class SubmissionAdminView(UserPassesTestMixin, SubmissionObjectMixin,
                           generic.DetailView, PresentationContextMixin):
     template_name = 'reviewpanel/submission.html'
@@ -511,6 +815,7 @@ class PresentationAdminView(SubmissionAdminView):
                                  slug=self.kwargs['form_slug'])
         
         form.model, form.item_model
+        self.program_form = form
         return form.model.objects.filter(_submitted__isnull=False).order_by('?')
     
     def get_object(self):